@@ -3,32 +3,59 @@ AFOLIE 背景透明化节点
 将指定颜色的背景转换为透明
 """
 
+import re
+from collections import OrderedDict
+
 import torch
+import torch.nn.functional as F
 import numpy as np
-from PIL import Image
 from scipy import ndimage
 
 
-def tensor2pil(image):
-    """Convert tensor to PIL Image (RGB) - handles single image tensor (H, W, C)"""
-    img_np = image.cpu().numpy()
-    # 确保是 3D 数组 (H, W, C)
-    if img_np.ndim == 4:
-        img_np = img_np.squeeze(0)
-    img_np = np.clip(255. * img_np, 0, 255).astype(np.uint8)
-    
-    # 根据通道数返回不同模式
-    if img_np.shape[2] == 4:
-        return Image.fromarray(img_np, mode='RGBA')
-    elif img_np.shape[2] == 3:
-        return Image.fromarray(img_np, mode='RGB')
-    else:
-        return Image.fromarray(img_np)
+# 颜色匹配查找表：每张表覆盖全部 2^24 种 RGB 颜色（16 MB），缓存最近使用的几张
+MATCH_LUT_CACHE_SIZE = 4
+# 批次像素数达到该值时，新建查找表比直接计算距离更划算
+MATCH_LUT_MIN_PIXELS = 1 << 22
+
+_match_luts = OrderedDict()
+
+# 色差公式：RGB 为欧几里得距离；ΔE 公式在 CIELAB 空间计算，容差百分比直接对应 ΔE 值
+COLOR_METRICS = ["RGB", "ΔE76", "ΔE2000"]
+# ΔE 公式下容差 100% 对应的色差（L* 的完整范围）
+DELTA_E_MAX = 100.0
+# sRGB (D65) 线性值到 XYZ 的矩阵，已除以 D65 白点
+SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+]) / np.array([0.95047, 1.0, 1.08883])[:, None]
+# 构建 ΔE 查找表时每次转换的红色通道层数（每层 65536 种颜色）
+LAB_LUT_CHUNK = 16
+# ΔE 查找表要转换全部颜色，构建代价远高于 RGB，批次达到该像素数才新建；
+# 更小的批次只对图像中出现的颜色计算色差
+DELTA_E_LUT_MIN_PIXELS = 1 << 24
+
+_srgb_linear = None
+
+# 自动估计背景色：透明色值中表示自动的写法
+AUTO_COLOR_NAMES = ("auto", "自动")
+# 边框采样带宽度（相对短边）和直方图每通道的位数
+BORDER_STRIP_RATIO = 0.02
+BORDER_HISTOGRAM_BITS = 5
 
+# 透明边缘模式：硬边缘为 0/1 透明度，柔和边缘在容差外的过渡范围内渐变
+EDGE_MODES = ["硬边缘", "柔和边缘"]
+# 去除溢色时透明度的下限，避免除以接近 0 的透明度
+DECONTAMINATE_MIN_ALPHA = 1e-3
 
-def pil2tensor(image):
-    """Convert PIL Image to tensor (supports RGBA) - returns (1, H, W, C)"""
-    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+# 代理处理：短边小于该值时不缩小，直接按原分辨率处理
+PROXY_MIN_SIZE = 64
+
+# 序列模式：按块比较相邻帧，块内任一像素变化则整块重新计算
+SEQUENCE_BLOCK_SIZE = 16
+
+# 裁剪到内容：逐帧按各自的内容区域裁剪（尺寸统一为最大的区域），或整批使用同一个区域
+TRIM_MODES = ["不裁剪", "逐帧裁剪", "统一裁剪"]
 
 
 def hex_to_rgb(hex_color):
@@ -36,34 +63,511 @@ def hex_to_rgb(hex_color):
     将十六进制颜色转换为 RGB 元组
     
     Args:
-        hex_color: 十六进制颜色字符串，如 '#ffffff' 或 'ffffff'
+        hex_color: 十六进制颜色字符串，如 '#ffffff'、'ffffff' 或简写 '#fff'
     
     Returns:
         (r, g, b) 元组，值范围 0-255
     """
-    hex_color = hex_color.lstrip('#')
+    hex_color = hex_color.strip().lstrip('#')
+    if len(hex_color) == 3:
+        hex_color = ''.join(c * 2 for c in hex_color)
     if len(hex_color) != 6:
         raise ValueError(f"无效的十六进制颜色: {hex_color}")
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
 
-def color_distance(img_array, target_rgb):
+def parse_key_colors(text, default_tolerance):
+    """
+    解析透明色值：一个或多个十六进制颜色，可为每个颜色单独指定容差
+    
+    颜色之间用逗号、分号或空白分隔，颜色后加 ":容差" 覆盖默认容差，
+    如 '#ffffff, #00ff00:15'；"auto"（或"自动"）表示从每帧边框估计背景色；
+    无效的条目被忽略
+    
+    Args:
+        text: 透明色值字符串
+        default_tolerance: 未单独指定时使用的容差百分比 (0-100)
+    
+    Returns:
+        [((r, g, b), 容差), ...]，自动估计的颜色为 (None, 容差)；没有有效颜色时为空列表
+    """
+    key_colors = []
+    for entry in re.split(r"[,;\s]+", text.strip()):
+        if not entry:
+            continue
+        color, _, tolerance = entry.partition(':')
+        try:
+            rgb = None if color.lower() in AUTO_COLOR_NAMES else hex_to_rgb(color)
+            tolerance = float(tolerance) if tolerance else default_tolerance
+        except ValueError:
+            print(f"背景透明化: 忽略无效的颜色 {entry}")
+            continue
+        key_colors.append((rgb, min(max(tolerance, 0.0), 100.0)))
+    return key_colors
+
+
+def estimate_border_colors(rgb):
+    """
+    从每帧四周的边框带估计背景色
+    
+    边框像素按每通道高位量化做直方图，取像素最多的一格，
+    再对落在该格内的像素求平均得到精确颜色；整个批次一次完成
+    
+    Args:
+        rgb: uint8 张量 (B, H, W, 3)
+    
+    Returns:
+        [(r, g, b), ...]，每帧一个颜色
+    """
+    batch_size, height, width = rgb.shape[0], rgb.shape[1], rgb.shape[2]
+    strip = max(1, int(round(min(height, width) * BORDER_STRIP_RATIO)))
+    # 上下两条带覆盖整行，左右两条带不含上下带已覆盖的角落
+    border = torch.cat([
+        rgb[:, :strip].reshape(batch_size, -1, 3),
+        rgb[:, -strip:].reshape(batch_size, -1, 3),
+        rgb[:, strip:-strip, :strip].reshape(batch_size, -1, 3),
+        rgb[:, strip:-strip, -strip:].reshape(batch_size, -1, 3),
+    ], dim=1).to(torch.int64)
+    
+    shift = 8 - BORDER_HISTOGRAM_BITS
+    bins = 1 << (3 * BORDER_HISTOGRAM_BITS)
+    coarse = border >> shift
+    index = (coarse[..., 0] << (2 * BORDER_HISTOGRAM_BITS)) | (coarse[..., 1] << BORDER_HISTOGRAM_BITS) | coarse[..., 2]
+    offsets = torch.arange(batch_size)[:, None] * bins
+    histogram = torch.bincount((index + offsets).flatten(), minlength=batch_size * bins)
+    mode = histogram.view(batch_size, bins).argmax(dim=1)
+    
+    in_mode = (index == mode[:, None]).unsqueeze(-1)
+    colors = (border * in_mode).sum(dim=1).double() / in_mode.sum(dim=1).double()
+    return [tuple(int(c) for c in color) for color in colors.round().to(torch.int64).tolist()]
+
+
+def rgb_to_hex(rgb):
+    """将 (r, g, b) 转换为 '#rrggbb'"""
+    return "#{:02x}{:02x}{:02x}".format(*rgb)
+
+
+def srgb_linear_table():
+    """sRGB 通道值 0-255 到线性值的查找表 (256,)，首次使用时生成"""
+    global _srgb_linear
+    if _srgb_linear is None:
+        c = np.arange(256) / 255.0
+        _srgb_linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4).astype(np.float32)
+    return _srgb_linear
+
+
+def rgb_to_lab(pixels):
+    """
+    将 uint8 RGB 转换为 CIELAB (D65)
+    
+    Args:
+        pixels: uint8 数组 (..., 3)
+    
+    Returns:
+        float32 数组 (..., 3)：L*, a*, b*
+    """
+    xyz = srgb_linear_table()[pixels] @ SRGB_TO_XYZ.T.astype(np.float32)
+    epsilon, kappa = 216 / 24389, 24389 / 27
+    f = np.where(xyz > epsilon, np.cbrt(xyz), (kappa * xyz + 16) / 116)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def unique_colors(pixels):
+    """
+    找出图像中出现的颜色，ΔE 只需对每种颜色计算一次
+    
+    用覆盖全部 2^24 种颜色的表代替排序去重
+    
+    Args:
+        pixels: uint8 数组 (..., 3)
+    
+    Returns:
+        (colors, inverse)：出现的颜色 uint8 (U, 3)，每个像素对应的颜色序号 (...)
+    """
+    index = (pixels[..., 0].astype(np.int32) << 16) | (pixels[..., 1].astype(np.int32) << 8) | pixels[..., 2]
+    present = np.zeros(1 << 24, dtype=bool)
+    present[index] = True
+    codes = np.flatnonzero(present).astype(np.int32)
+    lookup = np.empty(1 << 24, dtype=np.int32)
+    lookup[codes] = np.arange(len(codes), dtype=np.int32)
+    colors = np.stack([codes >> 16, (codes >> 8) & 255, codes & 255], axis=-1).astype(np.uint8)
+    return colors, lookup[index]
+
+
+def delta_e76(lab, target_lab):
+    """CIE76 色差：Lab 空间的欧几里得距离"""
+    diff = lab - np.asarray(target_lab, dtype=np.float32)
+    return np.sqrt(np.sum(diff * diff, axis=-1))
+
+
+def delta_e2000(lab, target_lab):
     """
-    计算图像中每个像素与目标颜色的欧几里得距离
+    CIEDE2000 色差
     
     Args:
-        img_array: numpy 数组，形状为 (H, W, 3)，值范围 0-255
+        lab: float32 数组 (..., 3)
+        target_lab: 目标颜色的 (L*, a*, b*)
+    
+    Returns:
+        float32 数组 (...)
+    """
+    L1, a1, b1 = lab[..., 0], lab[..., 1], lab[..., 2]
+    L2, a2, b2 = (float(v) for v in target_lab)
+    
+    C1 = np.hypot(a1, b1)
+    C2 = float(np.hypot(a2, b2))
+    C_mean7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C_mean7 / (C_mean7 + 25.0 ** 7)))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    
+    chroma_product = C1p * C2p
+    achromatic = chroma_product == 0
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh[achromatic] = 0
+    dL = L2 - L1
+    dC = C2p - C1p
+    dH = 2 * np.sqrt(chroma_product) * np.sin(np.radians(dh / 2))
+    
+    L_mean = (L1 + L2) / 2
+    C_mean = (C1p + C2p) / 2
+    h_sum = h1p + h2p
+    h_mean = np.where(np.abs(h1p - h2p) <= 180, h_sum / 2,
+                      np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    h_mean = np.where(achromatic, h_sum, h_mean)
+    
+    T = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean))
+         + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    d_theta = 30 * np.exp(-((h_mean - 275) / 25) ** 2)
+    C_mean7 = C_mean ** 7
+    R_C = 2 * np.sqrt(C_mean7 / (C_mean7 + 25.0 ** 7))
+    L_offset = (L_mean - 50) ** 2
+    S_L = 1 + 0.015 * L_offset / np.sqrt(20 + L_offset)
+    S_C = 1 + 0.045 * C_mean
+    S_H = 1 + 0.015 * C_mean * T
+    R_T = -np.sin(np.radians(2 * d_theta)) * R_C
+    
+    dL, dC, dH = dL / S_L, dC / S_C, dH / S_H
+    return np.sqrt(np.maximum(dL * dL + dC * dC + dH * dH + R_T * dC * dH, 0)).astype(np.float32)
+
+
+def lab_distance(lab, target_rgb, metric):
+    """Lab 像素到目标颜色的 ΔE 色差"""
+    target_lab = rgb_to_lab(np.array(target_rgb, dtype=np.uint8))
+    if metric == "ΔE2000":
+        return delta_e2000(lab, target_lab)
+    return delta_e76(lab, target_lab)
+
+
+def to_uint8_rgb(images):
+    """
+    将批次图像 (B, H, W, C) 转换为 uint8 RGB 张量 (B, H, W, 3)
+    
+    值截断到 0-255，只保留 RGB 通道
+    """
+    return (images[..., :3] * 255.0).clamp_(0, 255).to(torch.uint8)
+
+
+def squared_color_distance(pixels, target_rgb):
+    """
+    计算批次中每个像素与目标颜色的平方欧几里得距离（整数运算，无需开方）
+    
+    Args:
+        pixels: uint8 张量 (B, H, W, 3)
         target_rgb: 目标颜色 (r, g, b)，值范围 0-255
     
     Returns:
-        距离数组，形状为 (H, W)，值范围 0-441.67（sqrt(255^2 * 3)）
+        int32 张量 (B, H, W)，值范围 0-195075（255^2 * 3）
     """
-    target = np.array(target_rgb, dtype=np.float32)
-    diff = img_array.astype(np.float32) - target
-    distance = np.sqrt(np.sum(diff ** 2, axis=2))
+    distance = None
+    # 逐通道累加，避免生成 (B, H, W, 3) 的 int32 中间结果
+    for c in range(3):
+        diff = pixels[..., c].to(torch.int32) - int(target_rgb[c])
+        diff.mul_(diff)
+        distance = diff if distance is None else distance.add_(diff)
     return distance
 
 
+def to_squared_threshold(threshold):
+    """
+    将距离阈值转换为整数平方距离阈值：distance <= threshold 等价于 distance² <= 返回值
+    
+    平方距离是整数，结果取 floor(threshold²)，并按 float32 开方后比较的结果修正，
+    与逐像素开方的旧实现在边界上完全一致
+    """
+    squared = int(np.floor(float(threshold) ** 2)) + 1
+    while squared >= 0 and float(np.sqrt(np.float32(squared))) > threshold:
+        squared -= 1
+    return squared
+
+
+def build_match_lut(targets, metric="RGB"):
+    """
+    构建颜色匹配查找表
+    
+    Args:
+        targets: ((r, g, b), 阈值) 的元组；RGB 时阈值为整数平方距离，ΔE 公式时为色差
+        metric: 色差公式
+    
+    Returns:
+        布尔数组 (256, 256, 256)，lut[r, g, b] 为 True 表示该颜色与任一目标颜色匹配
+    """
+    lut = np.zeros((256, 256, 256), dtype=bool)
+    if metric != "RGB":
+        # 分块把全部颜色转换到 Lab，每块的 Lab 值供所有目标颜色共用
+        channel = np.arange(256, dtype=np.uint8)
+        for start in range(0, 256, LAB_LUT_CHUNK):
+            colors = np.empty((LAB_LUT_CHUNK, 256, 256, 3), dtype=np.uint8)
+            colors[..., 0] = channel[start:start + LAB_LUT_CHUNK, None, None]
+            colors[..., 1] = channel[None, :, None]
+            colors[..., 2] = channel[None, None, :]
+            lab = rgb_to_lab(colors)
+            for target_rgb, threshold in targets:
+                lut[start:start + LAB_LUT_CHUNK] |= lab_distance(lab, target_rgb, metric) <= threshold
+        return lut
+    
+    channel = np.arange(256, dtype=np.int32)
+    for (r, g, b), squared_threshold in targets:
+        # 三个通道的平方差广播相加，得到所有颜色到目标颜色的平方距离
+        distance = ((channel - r) ** 2)[:, None, None] + ((channel - g) ** 2)[None, :, None]
+        distance = distance + ((channel - b) ** 2)[None, None, :]
+        lut |= distance <= squared_threshold
+    return lut
+
+
+def get_match_lut(targets, metric="RGB", build=True):
+    """
+    从 LRU 缓存中取出查找表；未缓存时 build 为 True 则构建并缓存，否则返回 None
+    """
+    key = (targets, metric)
+    lut = _match_luts.get(key)
+    if lut is not None:
+        _match_luts.move_to_end(key)
+        return lut
+    if not build:
+        return None
+    lut = build_match_lut(targets, metric)
+    _match_luts[key] = lut
+    while len(_match_luts) > MATCH_LUT_CACHE_SIZE:
+        _match_luts.popitem(last=False)
+    return lut
+
+
+def match_colors(rgb, targets, metric="RGB"):
+    """
+    计算批次中与目标颜色匹配的像素
+    
+    查找表已缓存或批次足够大时，每个像素只需一次查表；否则直接计算距离
+    
+    Args:
+        rgb: uint8 张量 (B, H, W, 3)
+        targets: ((r, g, b), 阈值) 的元组；RGB 时阈值为整数平方距离，ΔE 公式时为色差
+        metric: 色差公式
+    
+    Returns:
+        布尔张量 (B, H, W)
+    """
+    pixel_count = rgb.shape[0] * rgb.shape[1] * rgb.shape[2]
+    min_pixels = MATCH_LUT_MIN_PIXELS if metric == "RGB" else DELTA_E_LUT_MIN_PIXELS
+    lut = get_match_lut(targets, metric, build=pixel_count >= min_pixels)
+    
+    if lut is not None:
+        pixels = rgb.numpy()
+        index = (pixels[..., 0].astype(np.int32) << 16) | (pixels[..., 1].astype(np.int32) << 8) | pixels[..., 2]
+        return torch.from_numpy(lut.ravel().take(index))
+    
+    if metric != "RGB":
+        colors, inverse = unique_colors(rgb.numpy())
+        lab = rgb_to_lab(colors)
+        matched = np.zeros(len(colors), dtype=bool)
+        for target_rgb, threshold in targets:
+            matched |= lab_distance(lab, target_rgb, metric) <= threshold
+        return torch.from_numpy(matched[inverse])
+    
+    match_mask = None
+    for target_rgb, squared_threshold in targets:
+        matched = squared_color_distance(rgb, target_rgb) <= squared_threshold
+        match_mask = matched if match_mask is None else match_mask.logical_or_(matched)
+    return match_mask
+
+
+def soft_key_alpha(rgb, key_colors, band, max_distance, metric="RGB"):
+    """
+    按颜色距离计算柔和透明度
+    
+    距离在容差内完全透明 (0)，超过 容差 + 过渡范围 完全不透明 (1)，之间线性过渡；
+    多个透明色时每个像素取最透明的结果，并记录对应的透明色
+    
+    Args:
+        rgb: uint8 张量 (B, H, W, 3)
+        key_colors: [((r, g, b), 容差), ...]
+        band: 过渡范围（百分比）
+        max_distance: 容差 100% 对应的距离
+        metric: 色差公式
+    
+    Returns:
+        (alpha, key)
+        alpha: float32 张量 (B, H, W)
+        key: 每个像素最接近的透明色 float32 (B, H, W, 3)，值范围 0-1
+    """
+    alpha = None
+    nearest = None
+    # ΔE 公式下每种颜色只转换一次 Lab，供所有透明色共用
+    if metric != "RGB":
+        colors, inverse = unique_colors(rgb.numpy())
+        lab = rgb_to_lab(colors)
+    else:
+        lab = None
+    for index, (target_rgb, tolerance) in enumerate(key_colors):
+        inner = (tolerance / 100.0) * max_distance
+        if lab is not None:
+            distance = torch.from_numpy(lab_distance(lab, target_rgb, metric)[inverse])
+            if band > 0:
+                current = distance.sub_(inner).div_((band / 100.0) * max_distance).clamp_(0.0, 1.0)
+            else:
+                current = (distance > inner).float()
+        elif band > 0:
+            width = (band / 100.0) * max_distance
+            current = squared_color_distance(rgb, target_rgb).float().sqrt_().sub_(inner).div_(width).clamp_(0.0, 1.0)
+        else:
+            current = (squared_color_distance(rgb, target_rgb) > to_squared_threshold(inner)).float()
+        
+        if alpha is None:
+            alpha = current
+            nearest = torch.zeros(current.shape, dtype=torch.long)
+        else:
+            closer = current < alpha
+            alpha = torch.minimum(alpha, current)
+            nearest[closer] = index
+    
+    palette = torch.tensor([target_rgb for target_rgb, _ in key_colors], dtype=torch.float32) / 255.0
+    return alpha, palette[nearest]
+
+
+def decontaminate(rgb, alpha, semi, key):
+    """
+    去除半透明像素中透明色的溢色
+    
+    观察到的颜色 C = α·F + (1 - α)·K，反解得到前景色 F = K + (C - K) / α；
+    只读写 semi 选中的像素
+    
+    Args:
+        rgb: float32 张量 (B, H, W, 3)，值范围 0-1，原地修改
+        alpha: float32 张量 (B, H, W)
+        semi: 半透明像素 (0 < α < 1) 的布尔掩码 (B, H, W)
+        key: 每个半透明像素对应的透明色 (N, 3)，顺序与 rgb[semi] 相同
+    """
+    observed = rgb[semi]
+    coverage = alpha[semi].clamp_(min=DECONTAMINATE_MIN_ALPHA).unsqueeze_(-1)
+    rgb[semi] = (observed - key).div_(coverage).add_(key).clamp_(0.0, 1.0)
+
+
+def upsample_nearest(x, factor, height, width):
+    """
+    将代理结果按最近邻放大 factor 倍并裁剪到 (height, width)
+    
+    Args:
+        x: 张量 (B, h, w) 或 (B, h, w, C)
+    """
+    batch, h, w = x.shape[:3]
+    rest = x.shape[3:]
+    x = x[:, :, None, :, None].expand(batch, h, factor, w, factor, *rest)
+    return x.reshape(batch, h * factor, w * factor, *rest)[:, :height, :width].contiguous()
+
+
+def proxy_boundary(alpha):
+    """
+    代理图中需要在原分辨率下重新计算的边界单元：3×3 邻域内透明度不一致的位置
+    
+    Args:
+        alpha: float32 张量 (B, h, w)
+    
+    Returns:
+        布尔张量 (B, h, w)
+    """
+    x = alpha.unsqueeze(1)
+    high = F.max_pool2d(x, 3, stride=1, padding=1)
+    low = -F.max_pool2d(-x, 3, stride=1, padding=1)
+    return (high != low).squeeze(1)
+
+
+def changed_blocks(current, previous, threshold, block_size=SEQUENCE_BLOCK_SIZE):
+    """
+    找出相邻两帧之间发生变化的块
+    
+    Args:
+        current, previous: uint8 张量 (H, W, 3)
+        threshold: 任一通道差值大于该值的像素视为变化
+        block_size: 块大小
+    
+    Returns:
+        像素级布尔张量 (H, W)，变化块内的像素为 True
+    """
+    height, width = current.shape[:2]
+    # uint8 下用 max - min 求差值的绝对值，不会溢出
+    changed = torch.maximum(current, previous).sub_(torch.minimum(current, previous)).amax(dim=-1) > threshold
+    blocks = F.max_pool2d(changed[None, None].float(), block_size, ceil_mode=True)[0] > 0
+    return upsample_nearest(blocks, block_size, height, width)[0]
+
+
+def content_boxes(alpha, margin=0, uniform=False):
+    """
+    计算每帧不透明内容的边界框
+    
+    批次输出要求尺寸一致：逐帧裁剪时所有帧使用最大边界框的尺寸，
+    靠近图像边缘的窗口向内平移，窗口始终在图像内，边界框以外只有透明像素
+    
+    Args:
+        alpha: float32 张量 (B, H, W)
+        margin: 边界框向外扩展的像素数
+        uniform: 是否所有帧使用同一个（并集）边界框
+    
+    Returns:
+        每帧的裁剪区域 [(x, y, 宽, 高), ...]；全部透明时为整幅图像
+    """
+    batch_size, height, width = alpha.shape
+    opaque = alpha > 0
+    rows = opaque.any(dim=2)
+    cols = opaque.any(dim=1)
+    has_content = rows.any(dim=1)
+    if not has_content.any():
+        return [(0, 0, width, height)] * batch_size
+    
+    def span(lines, length):
+        lines = lines.to(torch.uint8)
+        # argmax 返回第一个最大值的位置
+        start = lines.argmax(dim=1)
+        stop = length - lines.flip(1).argmax(dim=1)
+        return start, stop
+    
+    top, bottom = span(rows, height)
+    left, right = span(cols, width)
+    if uniform:
+        top, bottom = top[has_content].min().expand(batch_size), bottom[has_content].max().expand(batch_size)
+        left, right = left[has_content].min().expand(batch_size), right[has_content].max().expand(batch_size)
+    else:
+        # 全透明的帧没有内容，窗口放在左上角
+        for bound in (top, bottom, left, right):
+            bound.masked_fill_(~has_content, 0)
+    
+    top = (top - margin).clamp_(min=0)
+    left = (left - margin).clamp_(min=0)
+    box_height = int(((bottom + margin).clamp_(max=height) - top).max())
+    box_width = int(((right + margin).clamp_(max=width) - left).max())
+    y = top.clamp_(max=height - box_height)
+    x = left.clamp_(max=width - box_width)
+    return [(int(x[i]), int(y[i]), box_width, box_height) for i in range(batch_size)]
+
+
 def find_edge_connected_regions(mask):
     """
     找到与图像边缘连通的区域
@@ -86,16 +590,13 @@ def find_edge_connected_regions(mask):
     # 使用标签连通区域
     labeled_array, num_features = ndimage.label(mask)
     
-    # 找到与边缘连通的标签
-    edge_labels = set(labeled_array[edge_seed])
-    edge_labels.discard(0)  # 移除背景标签
-    
-    # 创建结果掩码
-    edge_connected = np.zeros_like(mask, dtype=bool)
-    for label in edge_labels:
-        edge_connected |= (labeled_array == label)
+    # 标签查找表：与边缘连通的标签为 True，一次索引得到结果，
+    # 耗时与连通区域数量无关（逐个标签比较是 O(标签数 × H × W)）
+    edge_labels = np.zeros(num_features + 1, dtype=bool)
+    edge_labels[labeled_array[edge_seed]] = True
+    edge_labels[0] = False  # 背景标签
     
-    return edge_connected
+    return edge_labels[labeled_array]
 
 
 class AFOLIE背景透明化:
@@ -114,7 +615,8 @@ class AFOLIE背景透明化:
                 "图像": ("IMAGE",),
                 "透明色值": ("STRING", {
                     "default": "#ffffff",
-                    "multiline": False
+                    "multiline": False,
+                    "tooltip": "一个或多个十六进制颜色，用逗号分隔；颜色后加 \":容差\" 可单独指定容差，如 #ffffff, #00ff00:15；填 auto 则从每帧边框自动估计背景色"
                 }),
                 "颜色容差": ("FLOAT", {
                     "default": 10.0,
@@ -127,94 +629,281 @@ class AFOLIE背景透明化:
                     "default": True
                 }),
             },
+            "optional": {
+                "边缘模式": (EDGE_MODES, {
+                    "default": "硬边缘",
+                    "tooltip": "硬边缘：完全透明或完全不透明；柔和边缘：在容差外的过渡范围内透明度渐变，遮罩输出中间值"
+                }),
+                "过渡范围": ("FLOAT", {
+                    "default": 5.0,
+                    "min": 0.0,
+                    "max": 100.0,
+                    "step": 0.5,
+                    "tooltip": "柔和边缘时，颜色距离从容差到 容差+过渡范围 之间透明度从 0 渐变到 1（百分比）"
+                }),
+                "去除溢色": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "柔和边缘时，从半透明像素的颜色中去除透明色的溢色"
+                }),
+                "代理倍数": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 16,
+                    "step": 1,
+                    "tooltip": "大于 1 时先在缩小该倍数的代理图上匹配颜色和分析连通区域，再只在边界附近按原分辨率细化，适合超大图像；比该倍数更细的细节可能被忽略"
+                }),
+                "序列模式": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "批次为连续视频帧时开启：每帧只重新计算相对上一帧变化的块，透明区域不变时沿用上一帧的连通分析（开启后忽略代理倍数）"
+                }),
+                "帧差阈值": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 255,
+                    "step": 1,
+                    "tooltip": "序列模式下任一通道差值超过该值的像素视为变化；0 表示只有完全相同的块才沿用上一帧结果"
+                }),
+                "色差公式": (COLOR_METRICS, {
+                    "default": "RGB",
+                    "tooltip": "RGB 为欧几里得距离；ΔE76/ΔE2000 按人眼感知的色差匹配，容差百分比直接作为 ΔE 值（ΔE 约 2.3 为人眼可辨的最小差异）"
+                }),
+                "裁剪到内容": (TRIM_MODES, {
+                    "default": "不裁剪",
+                    "tooltip": "去掉周围的透明区域：逐帧裁剪按各帧内容区域裁剪（尺寸统一为最大的区域），统一裁剪整批使用所有帧内容的并集区域"
+                }),
+                "裁剪边距": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 4096,
+                    "step": 1,
+                    "tooltip": "裁剪时在内容区域外保留的像素数"
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE", "MASK")
-    RETURN_NAMES = ("图像", "遮罩")
+    RETURN_TYPES = ("IMAGE", "MASK", "STRING", "STRING")
+    RETURN_NAMES = ("图像", "遮罩", "透明色", "裁剪区域")
     FUNCTION = "make_transparent"
     CATEGORY = "AFOLIE/图像"
 
-    def make_transparent(self, 图像, 透明色值, 颜色容差, 保护主体内部颜色):
+    def key_alpha(self, rgb, frame_colors, soft, band, max_distance, metric="RGB"):
+        """
+        计算每个像素的透明度（不含连通分析）
+        
+        Args:
+            rgb: uint8 张量 (B, H, W, 3)
+            frame_colors: 每帧的透明色 [[((r, g, b), 容差), ...], ...]；所有帧相同时为同一个列表
+            soft: 是否柔和边缘
+            band: 柔和边缘的过渡范围（百分比）
+            max_distance: 容差 100% 对应的距离
+            metric: 色差公式
+        
+        Returns:
+            透明度 float32 张量 (B, H, W)，硬边缘时只有 0 和 1
+        """
+        batch_size = rgb.shape[0]
+        shared = all(colors is frame_colors[0] for colors in frame_colors)
+        
+        if soft:
+            if shared:
+                return soft_key_alpha(rgb, frame_colors[0], band, max_distance, metric)[0]
+            alpha = torch.empty(rgb.shape[:3], dtype=torch.float32)
+            for i in range(batch_size):
+                alpha[i:i + 1] = soft_key_alpha(rgb[i:i + 1], frame_colors[i], band, max_distance, metric)[0]
+            return alpha
+        
+        def build_targets(colors):
+            # RGB 使用整数平方距离阈值，ΔE 公式直接比较色差
+            threshold = to_squared_threshold if metric == "RGB" else float
+            return tuple(sorted({
+                (target_rgb, threshold((tolerance / 100.0) * max_distance))
+                for target_rgb, tolerance in colors
+            }))
+        
+        # 所有颜色一起计算匹配掩码 (True = 匹配任一目标颜色，需要透明化)
+        if shared:
+            match_mask = match_colors(rgb, build_targets(frame_colors[0]), metric)
+        else:
+            # 自动估计时每帧的背景色不同，逐帧匹配
+            match_mask = torch.empty(rgb.shape[:3], dtype=torch.bool)
+            for i in range(batch_size):
+                match_mask[i] = match_colors(rgb[i:i + 1], build_targets(frame_colors[i]), metric)[0]
+        return torch.logical_not(match_mask).float()
+    
+    def protect_interior(self, alpha):
+        """只保留与图像边缘连通的透明区域，其余区域恢复不透明（连通分析逐帧进行）"""
+        candidates = (alpha < 1).numpy()
+        edge_connected = torch.from_numpy(np.stack([
+            find_edge_connected_regions(candidates[i]) for i in range(alpha.shape[0])
+        ]))
+        return alpha.masked_fill_(~edge_connected, 1.0)
+    
+    def for_selected_pixels(self, rgb, selected, frame_colors, compute):
+        """
+        对选中的像素逐组调用 compute(像素 (1, 1, N, 3), 透明色列表)，返回拼接后的结果
+        
+        所有帧透明色相同时一次处理整个批次，否则逐帧处理；结果顺序与 rgb[selected] 相同
+        """
+        if all(colors is frame_colors[0] for colors in frame_colors):
+            return compute(rgb[selected].view(1, 1, -1, 3), frame_colors[0])
+        return torch.cat([
+            compute(rgb[i][selected[i]].view(1, 1, -1, 3), frame_colors[i])
+            for i in range(rgb.shape[0])
+        ], dim=2)
+    
+    def sequence_alpha(self, rgb, frame_colors, soft, band, max_distance, metric, protect, threshold):
+        """
+        逐帧计算透明度，沿用上一帧未变化块的结果
+        
+        第一帧和透明色与上一帧不同的帧完整计算；其余帧只重新计算变化块内的像素。
+        连通分析只取决于候选透明区域，候选区域与上一帧相同时直接沿用上一帧的结果
+        
+        Returns:
+            透明度 float32 张量 (B, H, W)
+        """
+        alpha = torch.empty(rgb.shape[:3], dtype=torch.float32)
+        current = None
+        candidates = None
+        edge_connected = None
+        
+        for i in range(rgb.shape[0]):
+            colors = [frame_colors[i]]
+            if current is None or frame_colors[i] != frame_colors[i - 1]:
+                current = self.key_alpha(rgb[i:i + 1], colors, soft, band, max_distance, metric)[0]
+            else:
+                region = changed_blocks(rgb[i], rgb[i - 1], threshold)
+                if region.any():
+                    current = current.clone()
+                    current[region] = self.key_alpha(
+                        rgb[i][region].view(1, 1, -1, 3), colors, soft, band, max_distance, metric
+                    ).view(-1)
+            
+            if protect:
+                frame_candidates = current < 1
+                if candidates is None or not torch.equal(frame_candidates, candidates):
+                    edge_connected = torch.from_numpy(find_edge_connected_regions(frame_candidates.numpy()))
+                    candidates = frame_candidates
+                alpha[i] = current.masked_fill(~edge_connected, 1.0)
+            else:
+                alpha[i] = current
+        return alpha
+    
+    def make_transparent(self, 图像, 透明色值, 颜色容差, 保护主体内部颜色,
+                         边缘模式="硬边缘", 过渡范围=5.0, 去除溢色=True, 代理倍数=1,
+                         序列模式=False, 帧差阈值=0, 色差公式="RGB", 裁剪到内容="不裁剪", 裁剪边距=0):
         """
         将指定颜色的背景转换为透明
         
         Args:
             图像: 输入图像张量 (B, H, W, C)
-            透明色值: 十六进制颜色字符串，如 '#ffffff'
-            颜色容差: 颜色匹配容差百分比 (0-100)
+            透明色值: 十六进制颜色字符串，如 '#ffffff'；多个颜色用逗号分隔，可带单独容差；
+                auto 表示从每帧边框估计
+            颜色容差: 颜色匹配容差百分比 (0-100)，未单独指定容差的颜色使用
             保护主体内部颜色: 是否保护主体内部的相似颜色
+            边缘模式: 硬边缘或柔和边缘
+            过渡范围: 柔和边缘的过渡范围百分比
+            去除溢色: 柔和边缘时是否去除半透明像素中的透明色溢色
+            代理倍数: 大于 1 时在缩小的代理图上处理，只在边界附近按原分辨率细化
+            序列模式: 是否按连续视频帧处理，只重新计算相对上一帧变化的块
+            帧差阈值: 序列模式下判断像素变化的通道差值
+            色差公式: RGB 欧几里得距离或 CIELAB 的 ΔE76/ΔE2000
+            裁剪到内容: 是否裁剪掉内容周围的透明区域（逐帧或整批统一）
+            裁剪边距: 裁剪时在内容区域外保留的像素数
         
         Returns:
-            (透明图像 RGBA, 遮罩)
+            (透明图像 RGBA, 遮罩, 实际使用的透明色：每帧一行, 裁剪区域：每帧一行 "x,y,宽,高")
         """
         # 解析目标颜色
-        try:
-            target_rgb = hex_to_rgb(透明色值)
-        except ValueError:
+        key_colors = parse_key_colors(透明色值, 颜色容差)
+        if not key_colors:
             # 如果颜色无效，默认使用白色
-            target_rgb = (255, 255, 255)
+            key_colors = [((255, 255, 255), 颜色容差)]
         
-        batch_size = 图像.shape[0]
+        batch_size, height, width = 图像.shape[0], 图像.shape[1], 图像.shape[2]
         
-        # 计算颜色距离阈值
-        # 最大距离约为 441.67 (sqrt(255^2 * 3))
-        max_distance = np.sqrt(255**2 * 3)
-        threshold = (颜色容差 / 100.0) * max_distance
+        # 容差 100% 对应的距离：RGB 约为 441.67 (sqrt(255^2 * 3))，ΔE 公式为 100
+        metric = 色差公式 if 色差公式 in COLOR_METRICS else "RGB"
+        max_distance = np.sqrt(255**2 * 3) if metric == "RGB" else DELTA_E_MAX
         
-        result_images = []
-        result_masks = []
+        # 整个批次一次性转换为 uint8
+        rgb = to_uint8_rgb(图像.cpu())
         
-        for i in range(batch_size):
-            img = 图像[i]
-            
-            # 转换为 PIL 图像
-            pil_img = tensor2pil(img)
-            
-            # 转换为 numpy 数组，值范围 0-255
-            img_array = np.array(pil_img)
-            
-            # 确保只使用 RGB 通道进行颜色距离计算
-            if img_array.ndim == 3 and img_array.shape[2] == 4:
-                # RGBA 图像，只取 RGB 通道
-                rgb_array = img_array[:, :, :3]
-            else:
-                rgb_array = img_array
-            
-            # 计算每个像素与目标颜色的距离
-            distance = color_distance(rgb_array, target_rgb)
-            
-            # 创建匹配掩码 (True = 匹配目标颜色，需要透明化)
-            match_mask = distance <= threshold
+        # 每帧使用的透明色；自动估计时每帧的背景色不同
+        if any(target_rgb is None for target_rgb, _ in key_colors):
+            estimated = estimate_border_colors(rgb)
+            frame_colors = [
+                [(estimated[i] if c is None else c, tolerance) for c, tolerance in key_colors]
+                for i in range(batch_size)
+            ]
+        else:
+            frame_colors = [key_colors] * batch_size
+        
+        # 每帧实际使用的透明色，便于检查自动估计的结果
+        color_report = "\n".join(
+            ", ".join(rgb_to_hex(c) for c, _ in colors) for colors in frame_colors
+        )
+        
+        soft = 边缘模式 == "柔和边缘"
+        factor = 代理倍数 if min(height, width) // max(代理倍数, 1) >= PROXY_MIN_SIZE else 1
+        
+        if 序列模式 and batch_size > 1:
+            final_mask = self.sequence_alpha(rgb, frame_colors, soft, 过渡范围, max_distance, metric,
+                                             保护主体内部颜色, 帧差阈值)
+        elif factor > 1:
+            # 代理处理：在隔 factor 取样的代理图上匹配并分析连通区域，
+            # 结果按最近邻放大，再在原分辨率下重新计算代理边界附近的像素
+            proxy_alpha = self.key_alpha(rgb[:, ::factor, ::factor], frame_colors, soft, 过渡范围, max_distance, metric)
+            if 保护主体内部颜色:
+                proxy_alpha = self.protect_interior(proxy_alpha)
             
-            # 如果启用保护主体内部颜色
+            # 遮罩即透明度（硬边缘时为 0/1）：1.0 (前景/主体)，0.0 (背景/透明)
+            final_mask = upsample_nearest(proxy_alpha, factor, height, width)
+            boundary = upsample_nearest(proxy_boundary(proxy_alpha), factor, height, width)
+            # 边界像素的透明度按原分辨率重新计算；保护主体时只改写连通分析后仍透明的区域附近，
+            # 被保护的内部区域在代理图上为 1，周围不会形成边界
+            final_mask[boundary] = self.for_selected_pixels(
+                rgb, boundary, frame_colors,
+                lambda pixels, colors: self.key_alpha(pixels, [colors], soft, 过渡范围, max_distance, metric)
+            ).view(-1)
+        else:
+            # 柔和边缘时透明度小于 1 的像素参与连通分析
+            final_mask = self.key_alpha(rgb, frame_colors, soft, 过渡范围, max_distance, metric)
+            # 如果启用保护主体内部颜色，只透明化与边缘连通的区域
+            # （所有颜色的合并掩码只做一次连通分析）
             if 保护主体内部颜色:
-                # 只透明化与边缘连通的区域
-                transparent_mask = find_edge_connected_regions(match_mask)
+                final_mask = self.protect_interior(final_mask)
+        
+        # 裁剪到内容：先裁剪再组装输出，只处理裁剪后的像素
+        if 裁剪到内容 in TRIM_MODES[1:]:
+            boxes = content_boxes(final_mask, 裁剪边距, uniform=裁剪到内容 == "统一裁剪")
+            x, y, width, height = boxes[0]
+            if all(box == boxes[0] for box in boxes):
+                rgb = rgb[:, y:y + height, x:x + width]
+                final_mask = final_mask[:, y:y + height, x:x + width].contiguous()
             else:
-                transparent_mask = match_mask
-            
-            # 创建 RGBA 图像
-            rgba_array = np.zeros((rgb_array.shape[0], rgb_array.shape[1], 4), dtype=np.uint8)
-            rgba_array[:, :, :3] = rgb_array  # RGB 通道（确保是3通道）
-            rgba_array[:, :, 3] = 255  # Alpha 通道默认不透明
-            rgba_array[transparent_mask, 3] = 0  # 设置透明区域的 alpha 为 0
-            
-            # 转换为 PIL RGBA 图像，然后转为张量
-            rgba_pil = Image.fromarray(rgba_array, mode='RGBA')
-            rgba_tensor = pil2tensor(rgba_pil)  # (1, H, W, 4)
-            result_images.append(rgba_tensor)
-            
-            # 创建遮罩 - 从 alpha 通道提取
-            # alpha=255 -> 1.0 (前景/主体), alpha=0 -> 0.0 (背景/透明)
-            mask_array = (~transparent_mask).astype(np.float32)
-            mask_tensor = torch.from_numpy(mask_array).unsqueeze(0)
-            result_masks.append(mask_tensor)
+                rgb = torch.stack([rgb[i, y:y + height, x:x + width] for i, (x, y, _, _) in enumerate(boxes)])
+                final_mask = torch.stack([
+                    final_mask[i, y:y + height, x:x + width] for i, (x, y, _, _) in enumerate(boxes)
+                ])
+        else:
+            boxes = [(0, 0, width, height)] * batch_size
+        crop_report = "\n".join("{},{},{},{}".format(*box) for box in boxes)
         
-        # 合并批次
-        final_image = torch.cat(result_images, dim=0)  # (B, H, W, 4)
-        final_mask = torch.cat(result_masks, dim=0)    # (B, H, W)
+        # RGBA 图像：RGB 为量化后的原图，Alpha 与遮罩相同
+        final_image = torch.empty((batch_size, height, width, 4), dtype=torch.float32)
+        final_image[..., :3] = rgb
+        final_image[..., :3] /= 255.0
+        if soft and 去除溢色:
+            # 只为半透明像素求对应的透明色
+            semi = (final_mask > 0) & (final_mask < 1)
+            key = self.for_selected_pixels(
+                rgb, semi, frame_colors,
+                lambda pixels, colors: soft_key_alpha(pixels, colors, 过渡范围, max_distance, metric)[1]
+            ).view(-1, 3)
+            decontaminate(final_image[..., :3], final_mask, semi, key)
+        final_image[..., 3] = final_mask
         
-        return (final_image, final_mask)
+        return (final_image, final_mask, color_report, crop_report)
 
 
 # Node registration
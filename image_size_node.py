@@ -4,11 +4,22 @@ AFOLIE Image Size Nodes - 图像缩放节点
 """
 
 import os
+import math
+import hashlib
+import threading
 import subprocess
 import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import torch
+import torch.nn.functional as F
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
+
+from .pixel_snapper import (
+    snap_pixels, batch_palette, map_to_palette, detect_grid_params, PALETTE_SAMPLE_LIMIT
+)
 
 
 def tensor2pil(image):
@@ -16,11 +27,6 @@ def tensor2pil(image):
     return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
 
 
-def pil2tensor(image):
-    """Convert PIL Image to tensor"""
-    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
-
-
 # 采样方法列表（两个节点共用）
 SAMPLING_METHODS = [
     "两次立方(平滑渐变)",
@@ -32,6 +38,562 @@ SAMPLING_METHODS = [
     "两次线性"
 ]
 
+# 采样方法到 (PIL 滤镜, torch 插值模式, 卷积核, 边缘钳制) 的映射
+# - 卷积核为 RESAMPLE_KERNELS 中的名称，矩阵引擎和分块缩放使用
+# - torch 插值模式为 None 表示 F.interpolate 无法表达该卷积核，改用权重矩阵后端
+# - 边缘钳制为 True 时，结果被限制在源图邻域的最小/最大值之间（去除振铃和光晕）
+# - PIL 引擎只有内置滤镜，各方法使用最接近的一个
+RESAMPLE_FILTERS = {
+    "两次立方(平滑渐变)": (Image.BICUBIC, None, "mitchell", False),
+    "保留细节(扩大)": (Image.LANCZOS, None, "lanczos", False),
+    "保留细节2.0": (Image.LANCZOS, None, "lanczos", True),
+    "两次立方(较平滑)(扩大)": (Image.BICUBIC, "bicubic", "bicubic", False),
+    "两次立方(较锐利)(缩减)": (Image.BICUBIC, None, "bicubic_sharp", False),
+    "邻近(硬边缘)": (Image.NEAREST, "nearest-exact", "nearest", False),
+    "两次线性": (Image.BILINEAR, "bilinear", "bilinear", False)
+}
+
+
+def resample_spec(method):
+    """获取采样方法的 (PIL 滤镜, torch 插值模式, 卷积核, 边缘钳制)，未知方法按两次立方处理"""
+    return RESAMPLE_FILTERS.get(method, RESAMPLE_FILTERS["两次立方(较平滑)(扩大)"])
+
+# 像素缩放节点允许的最大宽高
+MAX_RESOLUTION = 16384
+
+# 快速缩小：先按整数倍做盒式缩小，直到剩余缩放比例不小于该值，再用所选滤镜
+# 与 PIL 的 reducing_gap 含义相同；值越小越快，但盒式预缩小带来的柔化越明显
+REDUCING_GAP = 2.0
+
+# 缩放引擎列表（两个节点共用）
+RESIZE_ENGINES = ["torch", "矩阵", "PIL"]
+
+# 权重矩阵缓存的最大条目数
+WEIGHT_CACHE_SIZE = 32
+
+# 权重矩阵按输出行分块的大小（每块只乘非零权重覆盖的输入区间）
+RESAMPLE_BLOCK_SIZE = 64
+
+
+def _bicubic_kernel(x, a=-0.5):
+    """两次立方（Keys）卷积核，a=-0.5 与 PIL 相同，a=-0.75 更锐利"""
+    x = x.abs()
+    x2 = x * x
+    x3 = x2 * x
+    near = (a + 2.0) * x3 - (a + 3.0) * x2 + 1.0
+    far = a * x3 - 5.0 * a * x2 + 8.0 * a * x - 4.0 * a
+    return torch.where(x < 1.0, near, torch.where(x < 2.0, far, torch.zeros_like(x)))
+
+
+def _sharp_bicubic_kernel(x):
+    """较锐利的两次立方卷积核（a=-0.75），适合缩小"""
+    return _bicubic_kernel(x, a=-0.75)
+
+
+def _mitchell_kernel(x, b=1.0 / 3.0, c=1.0 / 3.0):
+    """Mitchell-Netravali 卷积核，过冲很小，渐变平滑"""
+    x = x.abs()
+    x2 = x * x
+    x3 = x2 * x
+    near = ((12.0 - 9.0 * b - 6.0 * c) * x3 + (-18.0 + 12.0 * b + 6.0 * c) * x2 + (6.0 - 2.0 * b)) / 6.0
+    far = ((-b - 6.0 * c) * x3 + (6.0 * b + 30.0 * c) * x2
+           + (-12.0 * b - 48.0 * c) * x + (8.0 * b + 24.0 * c)) / 6.0
+    return torch.where(x < 1.0, near, torch.where(x < 2.0, far, torch.zeros_like(x)))
+
+
+def _lanczos_kernel(x, lobes=3):
+    """Lanczos 卷积核"""
+    return torch.where(
+        x.abs() < lobes,
+        torch.sinc(x) * torch.sinc(x / lobes),
+        torch.zeros_like(x)
+    )
+
+
+def _triangle_kernel(x):
+    """两次线性（三角）卷积核"""
+    return (1.0 - x.abs()).clamp_(min=0.0)
+
+
+# 重采样卷积核注册表: 名称 -> (卷积核, 支撑半径, 是否有负瓣)
+# 有负瓣的卷积核会产生过冲，结果需要限制到 [0, 1]
+# "nearest" 不需要卷积核，由 _axis_weights 单独处理
+RESAMPLE_KERNELS = {
+    "nearest": (None, 0.0, False),
+    "bilinear": (_triangle_kernel, 1.0, False),
+    "bicubic": (_bicubic_kernel, 2.0, True),
+    "bicubic_sharp": (_sharp_bicubic_kernel, 2.0, True),
+    "mitchell": (_mitchell_kernel, 2.0, True),
+    "lanczos": (_lanczos_kernel, 3.0, True),
+}
+
+
+def _axis_weights(in_size, out_size, filter_name, out_start=0, out_end=None,
+                  in_start=0, in_end=None, in_extent=None):
+    """
+    计算单个轴的重采样权重矩阵 (out_end - out_start, in_end - in_start)
+    
+    采样位置和缩小时的支撑扩展与 PIL 的 ImagingResample 相同，
+    每一行是一个输出像素对 [in_start, in_end) 内输入像素的归一化权重。
+    in_extent 为映射到输出的输入范围 [0, in_extent)，默认等于 in_size
+    （盒式预缩小后最后一个像素可能只覆盖部分源像素）
+    """
+    out_end = out_size if out_end is None else out_end
+    in_end = in_size if in_end is None else in_end
+    scale = (in_size if in_extent is None else in_extent) / out_size
+    centers = (torch.arange(out_start, out_end, dtype=torch.float64) + 0.5) * scale
+    
+    if filter_name == "nearest":
+        # 邻近：每个输出像素只取中心所在的输入像素
+        index = centers.floor().long().clamp_(0, in_size - 1) - in_start
+        weights = torch.zeros((out_end - out_start, in_end - in_start), dtype=torch.float64)
+        weights[torch.arange(out_end - out_start), index] = 1.0
+        return weights.float()
+    
+    kernel, support, _ = RESAMPLE_KERNELS[filter_name]
+    # 缩小时按比例拉宽滤镜，起到抗锯齿作用
+    filter_scale = max(scale, 1.0)
+    positions = torch.arange(in_start, in_end, dtype=torch.float64) + 0.5
+    weights = kernel((positions[None, :] - centers[:, None]) / filter_scale)
+    
+    # 限制在支撑范围内并归一化
+    distance = (positions[None, :] - centers[:, None]).abs()
+    weights = torch.where(distance < support * filter_scale, weights, torch.zeros_like(weights))
+    total = weights.sum(dim=1, keepdim=True)
+    weights = weights / torch.where(total == 0, torch.ones_like(total), total)
+    return weights.float()
+
+
+def _input_span(in_size, out_size, filter_name, out_start, out_end, in_extent=None):
+    """计算输出区间 [out_start, out_end) 所依赖的输入区间（包含滤镜半径）"""
+    scale = (in_size if in_extent is None else in_extent) / out_size
+    radius = RESAMPLE_KERNELS[filter_name][1] * max(scale, 1.0)
+    in_start = math.floor((out_start + 0.5) * scale - radius)
+    in_end = math.ceil((out_end - 0.5) * scale + radius) + 1
+    return max(0, in_start), min(in_size, in_end)
+
+
+def _band_blocks(in_size, out_size, filter_name, in_extent=None, block_size=RESAMPLE_BLOCK_SIZE):
+    """
+    按输出行把单个轴的权重矩阵切成带状块
+    
+    每块只计算并保留滤镜支撑覆盖的输入区间，避免构造和乘以稠密矩阵
+    
+    Returns:
+        [(out_start, out_end, in_start, in_end, block_weights), ...]
+    """
+    blocks = []
+    for out_start in range(0, out_size, block_size):
+        out_end = min(out_start + block_size, out_size)
+        in_start, in_end = _input_span(
+            in_size, out_size, filter_name, out_start, out_end, in_extent
+        )
+        blocks.append((
+            out_start, out_end, in_start, in_end,
+            _axis_weights(
+                in_size, out_size, filter_name, out_start, out_end, in_start, in_end, in_extent
+            )
+        ))
+    return blocks
+
+
+@lru_cache(maxsize=WEIGHT_CACHE_SIZE)
+def get_resample_weights(src_w, src_h, dst_w, dst_h, filter_name, device="cpu", src_extent=None):
+    """
+    获取 (垂直, 水平) 重采样权重，按尺寸和滤镜缓存（LRU）
+    
+    src_extent 为 (宽, 高) 的源映射范围，仅快速缩小时使用，见 box_reduce
+    
+    Returns:
+        (blocks_y, blocks_x): 两个轴的带状权重块，见 _band_blocks
+    """
+    extent_w, extent_h = src_extent if src_extent is not None else (None, None)
+    blocks_y = [
+        (o0, o1, i0, i1, w.to(device))
+        for o0, o1, i0, i1, w in _band_blocks(src_h, dst_h, filter_name, extent_h)
+    ]
+    blocks_x = [
+        (o0, o1, i0, i1, w.to(device))
+        for o0, o1, i0, i1, w in _band_blocks(src_w, dst_w, filter_name, extent_w)
+    ]
+    return blocks_y, blocks_x
+
+
+def _apply_axis_weights(x, blocks, out_size, axis):
+    """
+    沿高度 (axis=1) 或宽度 (axis=2) 对整个批次应用权重块
+    
+    Args:
+        x: 输入张量 (B, H, W, C)
+        blocks: _band_blocks 返回的权重块
+        out_size: 该轴的输出尺寸
+        axis: 1 表示高度，2 表示宽度
+    """
+    if axis == 2:
+        # 宽度方向的块切片在内存中不连续，逐块转置相乘很慢；
+        # 整体转置一次后按高度处理，每块都是连续的 (n_in, H*C) 矩阵
+        out = _apply_axis_weights(x.transpose(1, 2).contiguous(), blocks, out_size, axis=1)
+        return out.transpose(1, 2).contiguous()
+    
+    batch_size, _, width, channels = x.shape
+    out = x.new_empty((batch_size, out_size, width, channels))
+    for out_start, out_end, in_start, in_end, weights in blocks:
+        # (n_out, n_in) @ (B, n_in, W*C)
+        src = x[:, in_start:in_end].reshape(batch_size, in_end - in_start, width * channels)
+        out[:, out_start:out_end] = torch.matmul(weights.to(x.dtype), src).view(
+            batch_size, out_end - out_start, width, channels
+        )
+    return out
+
+
+def _separable_resample(x, blocks_y, blocks_x, height, width):
+    """沿高度和宽度应用权重块，先处理能让中间结果更小的那个轴"""
+    src_h, src_w = x.shape[1], x.shape[2]
+    if height * src_w <= src_h * width:
+        out = _apply_axis_weights(x, blocks_y, height, axis=1)
+        return _apply_axis_weights(out, blocks_x, width, axis=2)
+    out = _apply_axis_weights(x, blocks_x, width, axis=2)
+    return _apply_axis_weights(out, blocks_y, height, axis=1)
+
+
+def _window_index(in_size, out_size, in_extent=None):
+    """
+    边缘钳制用的邻域索引 (out_size, 2r+1)
+    
+    以每个输出像素的邻近采样位置为中心，半径 r 覆盖一个输出像素对应的源区域
+    """
+    scale = (in_size if in_extent is None else in_extent) / out_size
+    radius = max(1, math.ceil(scale))
+    centers = ((torch.arange(out_size, dtype=torch.float64) + 0.5) * scale).floor().long()
+    offsets = torch.arange(-radius, radius + 1)
+    return (centers[:, None] + offsets[None, :]).clamp_(0, in_size - 1)
+
+
+def _gather_axis(x, index, dim):
+    """沿 dim 按一维索引取出 (B, H, W, C) 张量的切片（torch.gather 比 index_select 快得多）"""
+    shape = list(x.shape)
+    shape[dim] = index.shape[0]
+    view = [1, 1, 1, 1]
+    view[dim] = -1
+    return torch.gather(x, dim, index.view(view).expand(shape))
+
+
+def _axis_extrema(low, high, index, dim):
+    """
+    沿 dim 按邻域索引分别求 low 的局部最小值和 high 的局部最大值
+    
+    索引的每一行是 clamp(中心 + 偏移)，即边缘复制的连续窗口：
+    - 输入不长于输出（放大）时，先在输入上按偏移滑动求出每个位置的窗口极值，再按中心取一次，
+      不必在输出尺寸上收集 2r+1 次
+    - 缩小时逐个偏移收集后取极值（每次只收集一个偏移，内存与输出同量级）
+    """
+    size = low.shape[dim]
+    radius = (index.shape[1] - 1) // 2
+    index = index.to(low.device)
+    
+    if size <= index.shape[0]:
+        window_low, window_high = low.clone(), high.clone()
+        # 超出边缘的偏移取到的是边缘像素，已包含在更小的偏移中
+        for k in range(1, min(radius, size - 1) + 1):
+            for out, src, op in ((window_low, low, torch.minimum), (window_high, high, torch.maximum)):
+                ahead = out.narrow(dim, 0, size - k)
+                op(ahead, src.narrow(dim, k, size - k), out=ahead)
+                behind = out.narrow(dim, k, size - k)
+                op(behind, src.narrow(dim, 0, size - k), out=behind)
+        centers = index[:, radius]
+        return _gather_axis(window_low, centers, dim), _gather_axis(window_high, centers, dim)
+    
+    low_out = _gather_axis(low, index[:, 0], dim)
+    high_out = _gather_axis(high, index[:, 0], dim)
+    for k in range(1, index.shape[1]):
+        torch.minimum(low_out, _gather_axis(low, index[:, k], dim), out=low_out)
+        torch.maximum(high_out, _gather_axis(high, index[:, k], dim), out=high_out)
+    return low_out, high_out
+
+
+def _window_extrema(x, index_y, index_x):
+    """
+    按邻域索引计算 (B, H, W, C) 张量的局部最小/最大值
+    
+    先处理能让中间结果更小的轴；比例相同时先处理宽度（宽度方向的收集较慢，放在较小的中间结果上），
+    结果尺寸为 (B, n_y, n_x, C)
+    """
+    if index_y.shape[0] * x.shape[2] < x.shape[1] * index_x.shape[0]:
+        low, high = _axis_extrema(x, x, index_y, dim=1)
+        return _axis_extrema(low, high, index_x, dim=2)
+    low, high = _axis_extrema(x, x, index_x, dim=2)
+    return _axis_extrema(low, high, index_y, dim=1)
+
+
+def _finish_resample(x, out, filter_name, edge_clamp, window_index=None):
+    """
+    重采样后处理
+    
+    - 边缘钳制（保留细节2.0）：把每个输出像素限制在源图对应位置邻域的
+      最小/最大值之间，保留 Lanczos 的锐度但去除边缘两侧的振铃和光晕
+    - 有负瓣的卷积核：与 PIL 一样把过冲限制到 [0, 1]
+    
+    Args:
+        x: 源图（或分块的源区域）
+        out: 重采样结果
+        window_index: (垂直, 水平) 邻域索引，见 _window_index，坐标相对于 x
+    """
+    if edge_clamp:
+        low, high = _window_extrema(x, window_index[0], window_index[1])
+        return torch.maximum(torch.minimum(out, high, out=out), low, out=out)
+    if RESAMPLE_KERNELS[filter_name][2]:
+        return out.clamp_(0.0, 1.0)
+    return out
+
+
+def resize_with_matrix(images, width, height, method, src_extent=None):
+    """
+    使用缓存的可分离权重矩阵调整批次图像大小
+    
+    整个批次沿高度和宽度各做一次（分块的）矩阵乘法，
+    先处理能让中间结果更小的那个轴
+    """
+    _, _, filter_name, edge_clamp = resample_spec(method)
+    src_h, src_w = images.shape[1], images.shape[2]
+    
+    x = images if images.is_floating_point() else images.float()
+    blocks_y, blocks_x = get_resample_weights(
+        src_w, src_h, width, height, filter_name, str(x.device), src_extent
+    )
+    out = _separable_resample(x, blocks_y, blocks_x, height, width)
+    
+    window_index = None
+    if edge_clamp:
+        extent_w, extent_h = src_extent if src_extent is not None else (None, None)
+        window_index = (
+            _window_index(src_h, height, extent_h),
+            _window_index(src_w, width, extent_w)
+        )
+    return _finish_resample(x, out, filter_name, edge_clamp, window_index)
+
+
+def _shift_blocks(blocks, out_offset, in_offset):
+    """将权重块的坐标平移到分块内的局部坐标"""
+    return [
+        (o0 - out_offset, o1 - out_offset, i0 - in_offset, i1 - in_offset, w)
+        for o0, o1, i0, i1, w in blocks
+    ]
+
+
+def _tile_elements(blocks_y, blocks_x, group):
+    """估算每个分块（group 个权重块见方）单帧单通道的峰值元素数"""
+    peak = 0
+    for gy in range(0, len(blocks_y), group):
+        ys = blocks_y[gy:gy + group]
+        in_h = ys[-1][3] - ys[0][2]
+        out_h = ys[-1][1] - ys[0][0]
+        for gx in range(0, len(blocks_x), group):
+            xs = blocks_x[gx:gx + group]
+            in_w = xs[-1][3] - xs[0][2]
+            out_w = xs[-1][1] - xs[0][0]
+            # 输入切片 + 垂直缩放的中间结果 + 输出分块
+            peak = max(peak, in_h * in_w + out_h * in_w + out_h * out_w)
+    return peak
+
+
+def resize_tiled(images, width, height, method, memory_mb, src_extent=None):
+    """
+    分块缩放，限制中间结果的内存占用
+    
+    输出被切成若干分块，每个分块只读取其滤镜半径覆盖的输入区域
+    （相邻分块的输入区域互相重叠），结果直接写入预分配的输出张量，
+    因此峰值内存只取决于 memory_mb，而与输出尺寸无关
+    
+    Args:
+        images: 输入图像张量 (B, H, W, C)
+        width: 目标宽度
+        height: 目标高度
+        method: 采样方法（SAMPLING_METHODS 中的一项）
+        memory_mb: 分块中间结果的内存上限（MB）
+        src_extent: 源映射范围 (宽, 高)，仅快速缩小时使用
+    """
+    _, _, filter_name, edge_clamp = resample_spec(method)
+    batch_size, src_h, src_w, channels = images.shape
+    
+    x = images if images.is_floating_point() else images.float()
+    blocks_y, blocks_x = get_resample_weights(
+        src_w, src_h, width, height, filter_name, str(x.device), src_extent
+    )
+    if edge_clamp:
+        extent_w, extent_h = src_extent if src_extent is not None else (None, None)
+        window_y = _window_index(src_h, height, extent_h)
+        window_x = _window_index(src_w, width, extent_w)
+    result = x.new_empty((batch_size, height, width, channels))
+    
+    # 选择分块大小：每个分块包含 group × group 个权重块
+    budget = memory_mb * 1024 * 1024 // (x.element_size() * channels)
+    group = max(len(blocks_y), len(blocks_x))
+    while group > 1 and _tile_elements(blocks_y, blocks_x, group) > budget:
+        group = (group + 1) // 2
+    # 分块足够小时一次处理多帧
+    frames = max(1, min(batch_size, budget // _tile_elements(blocks_y, blocks_x, group)))
+    
+    for f0 in range(0, batch_size, frames):
+        f1 = min(f0 + frames, batch_size)
+        for gy in range(0, len(blocks_y), group):
+            ys = blocks_y[gy:gy + group]
+            oy0, oy1, iy0, iy1 = ys[0][0], ys[-1][1], ys[0][2], ys[-1][3]
+            local_y = _shift_blocks(ys, oy0, iy0)
+            for gx in range(0, len(blocks_x), group):
+                xs = blocks_x[gx:gx + group]
+                ox0, ox1, ix0, ix1 = xs[0][0], xs[-1][1], xs[0][2], xs[-1][3]
+                local_x = _shift_blocks(xs, ox0, ix0)
+                
+                src = x[f0:f1, iy0:iy1, ix0:ix1]
+                tile = _separable_resample(src, local_y, local_x, oy1 - oy0, ox1 - ox0)
+                
+                window_index = None
+                if edge_clamp:
+                    # 邻域索引换算到分块的局部坐标
+                    window_index = (
+                        (window_y[oy0:oy1] - iy0).clamp_(0, iy1 - iy0 - 1),
+                        (window_x[ox0:ox1] - ix0).clamp_(0, ix1 - ix0 - 1)
+                    )
+                result[f0:f1, oy0:oy1, ox0:ox1] = _finish_resample(
+                    src, tile, filter_name, edge_clamp, window_index
+                )
+    
+    return result
+
+
+def resize_with_pil(images, width, height, method, workers=1, reducing_gap=None):
+    """
+    逐帧使用 PIL 调整批次图像大小
+    
+    PIL 的 resize 会释放 GIL，workers > 1 时用线程池并行处理各帧，
+    每帧按索引写入预分配的输出批次，结果顺序与输入一致
+    
+    Args:
+        images: 输入图像张量 (B, H, W, C)
+        width: 目标宽度
+        height: 目标高度
+        method: 采样方法（SAMPLING_METHODS 中的一项）
+        workers: 并行线程数
+        reducing_gap: 传给 PIL resize 的 reducing_gap（快速缩小），None 表示不预缩小
+    """
+    pil_filter = resample_spec(method)[0]
+    batch_size, channels = images.shape[0], images.shape[-1]
+    
+    # 预分配输出批次
+    result = torch.empty((batch_size, height, width, channels), dtype=torch.float32)
+    
+    def resize_frame(i):
+        # 转换为PIL进行高质量重采样
+        pil_img = tensor2pil(images[i])
+        resized = np.array(pil_img.resize((width, height), pil_filter, reducing_gap=reducing_gap))
+        frame = result[i]
+        frame.copy_(torch.from_numpy(resized.reshape(height, width, channels)))
+        frame.div_(255.0)
+    
+    if workers > 1 and batch_size > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, batch_size)) as executor:
+            # list() 等待全部完成，并把线程中的异常抛出
+            list(executor.map(resize_frame, range(batch_size)))
+    else:
+        for i in range(batch_size):
+            resize_frame(i)
+    
+    return result
+
+
+def resize_with_torch(images, width, height, method):
+    """
+    使用 torch 对整个批次一次性调整大小（抗锯齿插值）
+    
+    不经过 PIL 和 uint8 转换，直接在 (B, H, W, C) 张量上计算
+    F.interpolate 无法表达的卷积核（Lanczos、Mitchell、a=-0.75 两次立方）改用权重矩阵后端
+    """
+    mode = resample_spec(method)[1]
+    if mode is None:
+        return resize_with_matrix(images, width, height, method)
+    
+    # (B, H, W, C) -> (B, C, H, W)
+    x = images.movedim(-1, 1)
+    if not x.is_floating_point():
+        x = x.float()
+    
+    if mode == "nearest-exact":
+        # 与 PIL NEAREST 一致：按像素中心取样
+        out = F.interpolate(x, size=(height, width), mode=mode)
+    else:
+        # antialias 在缩小时按缩放比例扩展滤镜支撑，与 PIL 的重采样行为一致
+        out = F.interpolate(
+            x,
+            size=(height, width),
+            mode=mode,
+            align_corners=False,
+            antialias=True
+        )
+        # 两次立方会产生过冲，PIL 在 uint8 中会被截断，这里同样限制到 [0, 1]
+        out = out.clamp_(0.0, 1.0)
+    
+    return out.movedim(1, -1).contiguous()
+
+
+def box_reduce(images, width, height, gap=REDUCING_GAP):
+    """
+    快速缩小的预处理：按整数倍对整个批次做盒式平均（块均值）
+    
+    每个轴的缩小倍数取 floor(源尺寸 / (目标尺寸 × gap))，
+    保证剩余的缩放比例至少为 gap，再交给所选滤镜完成最终缩放。
+    边缘不足一块的像素按实际像素数取平均，不丢弃任何像素
+    
+    Returns:
+        (缩小后的图像张量, 源映射范围 (宽, 高))；
+        源映射范围是原图在缩小后坐标中的大小（可能不是整数），
+        最终缩放按它计算采样位置，避免边缘残块造成的几何偏移。
+        不需要预缩小时返回 (原张量, None)
+    """
+    src_h, src_w = images.shape[1], images.shape[2]
+    factor_x = max(1, int(src_w / (width * gap)))
+    factor_y = max(1, int(src_h / (height * gap)))
+    if factor_x == 1 and factor_y == 1:
+        return images, None
+    
+    x = images.movedim(-1, 1)
+    if not x.is_floating_point():
+        x = x.float()
+    x = F.avg_pool2d(x, (factor_y, factor_x), stride=(factor_y, factor_x), ceil_mode=True)
+    return x.movedim(1, -1).contiguous(), (src_w / factor_x, src_h / factor_y)
+
+
+def resize_images(images, width, height, method, engine="torch", memory_mb=0, workers=1, fast=False):
+    """
+    调整批次图像大小（两个缩放节点共用）
+    
+    Args:
+        images: 输入图像张量 (B, H, W, C)
+        width: 目标宽度
+        height: 目标高度
+        method: 采样方法（SAMPLING_METHODS 中的一项）
+        engine: 缩放引擎（RESIZE_ENGINES 中的一项）
+        memory_mb: 大于 0 时使用分块缩放（权重矩阵后端），限制中间结果内存
+        workers: PIL 引擎逐帧缩放的并行线程数
+        fast: 快速缩小，大比例缩小时先做整数倍盒式预缩小（邻近采样不受影响）
+    """
+    if fast and resample_spec(method)[0] != Image.NEAREST:
+        if engine == "PIL" and memory_mb <= 0:
+            return resize_with_pil(images, width, height, method, workers, REDUCING_GAP)
+        reduced, src_extent = box_reduce(images, width, height)
+        if src_extent is not None:
+            # 预缩小后的最终缩放需要非整数的源映射范围，由权重矩阵后端完成
+            if memory_mb > 0:
+                return resize_tiled(reduced, width, height, method, memory_mb, src_extent)
+            return resize_with_matrix(reduced, width, height, method, src_extent)
+    
+    if memory_mb > 0:
+        return resize_tiled(images, width, height, method, memory_mb)
+    if engine == "PIL":
+        return resize_with_pil(images, width, height, method, workers)
+    if engine == "矩阵":
+        return resize_with_matrix(images, width, height, method)
+    return resize_with_torch(images, width, height, method)
+
 
 class AFOLIE图像像素缩放:
     """
@@ -50,24 +612,48 @@ class AFOLIE图像像素缩放:
                 "宽度": ("INT", {
                     "default": 512,
                     "min": 2,
-                    "max": 2048,
+                    "max": MAX_RESOLUTION,
                     "step": 1
                 }),
                 "高度": ("INT", {
                     "default": 512,
                     "min": 2,
-                    "max": 2048,
+                    "max": MAX_RESOLUTION,
                     "step": 1
                 }),
                 "采样方法": (SAMPLING_METHODS,),
             },
+            "optional": {
+                "缩放引擎": (RESIZE_ENGINES, {
+                    "default": "torch",
+                    "tooltip": "torch：整个批次一次性插值；矩阵：缓存的权重矩阵，同尺寸重复缩放最快；PIL：逐帧缩放"
+                }),
+                "分块内存上限MB": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 64,
+                    "tooltip": "0 表示不分块；大于 0 时按分块缩放，中间结果不超过该内存（使用矩阵引擎），适合超大输出"
+                }),
+                "并行线程数": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 64,
+                    "step": 1,
+                    "tooltip": "PIL 引擎同时缩放的帧数，1 表示逐帧处理"
+                }),
+                "快速缩小": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "大比例缩小时先按整数倍做盒式预缩小，再用所选滤镜缩放；速度大幅提升，细节略微变软"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "resize_image"
     CATEGORY = "AFOLIE/图像"
 
-    def resize_image(self, 图像, 宽度, 高度, 采样方法):
+    def resize_image(self, 图像, 宽度, 高度, 采样方法, 缩放引擎="torch", 分块内存上限MB=0, 并行线程数=1, 快速缩小=False):
         """
         使用像素值调整图像大小
         
@@ -76,43 +662,14 @@ class AFOLIE图像像素缩放:
             宽度: 目标宽度（像素）
             高度: 目标高度（像素）
             采样方法: 重新采样算法
+            缩放引擎: torch / 矩阵 批量缩放，或 PIL 逐帧缩放
+            分块内存上限MB: 大于 0 时分块缩放，限制中间结果内存
+            并行线程数: PIL 引擎同时缩放的帧数
+            快速缩小: 大比例缩小时先做盒式预缩小
         """
-        batch_size = 图像.shape[0]
-        target_width = 宽度
-        target_height = 高度
-        
-        # 处理批次中的每个图像
-        resized_images = []
-        
-        for i in range(batch_size):
-            img = 图像[i]
-            
-            # 转换为PIL进行高质量重采样
-            pil_img = tensor2pil(img)
-            
-            # 将重采样方法映射到PIL滤镜
-            resample_map = {
-                "两次立方(平滑渐变)": Image.BICUBIC,
-                "保留细节(扩大)": Image.LANCZOS,
-                "保留细节2.0": Image.LANCZOS,
-                "两次立方(较平滑)(扩大)": Image.BICUBIC,
-                "两次立方(较锐利)(缩减)": Image.BICUBIC,
-                "邻近(硬边缘)": Image.NEAREST,
-                "两次线性": Image.BILINEAR
-            }
-            
-            pil_filter = resample_map.get(采样方法, Image.BICUBIC)
-            
-            # 使用PIL调整大小
-            resized_pil = pil_img.resize((target_width, target_height), pil_filter)
-            
-            # 转换回张量
-            resized_tensor = pil2tensor(resized_pil)
-            
-            resized_images.append(resized_tensor)
-        
-        # 将所有图像堆叠回批次
-        result = torch.cat(resized_images, dim=0)
+        result = resize_images(
+            图像, 宽度, 高度, 采样方法, 缩放引擎, 分块内存上限MB, 并行线程数, 快速缩小
+        )
         
         return (result,)
 
@@ -134,18 +691,42 @@ class AFOLIE图像倍数缩放:
                 "倍数": ("FLOAT", {
                     "default": 1.0,
                     "min": 0.01,
-                    "max": 12.0,
+                    "max": 64.0,
                     "step": 0.01
                 }),
                 "采样方法": (SAMPLING_METHODS,),
             },
+            "optional": {
+                "缩放引擎": (RESIZE_ENGINES, {
+                    "default": "torch",
+                    "tooltip": "torch：整个批次一次性插值；矩阵：缓存的权重矩阵，同尺寸重复缩放最快；PIL：逐帧缩放"
+                }),
+                "分块内存上限MB": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 64,
+                    "tooltip": "0 表示不分块；大于 0 时按分块缩放，中间结果不超过该内存（使用矩阵引擎），适合超大输出"
+                }),
+                "并行线程数": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 64,
+                    "step": 1,
+                    "tooltip": "PIL 引擎同时缩放的帧数，1 表示逐帧处理"
+                }),
+                "快速缩小": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "大比例缩小时先按整数倍做盒式预缩小，再用所选滤镜缩放；速度大幅提升，细节略微变软"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "resize_image"
     CATEGORY = "AFOLIE/图像"
 
-    def resize_image(self, 图像, 倍数, 采样方法):
+    def resize_image(self, 图像, 倍数, 采样方法, 缩放引擎="torch", 分块内存上限MB=0, 并行线程数=1, 快速缩小=False):
         """
         使用倍数调整图像大小
         
@@ -153,6 +734,10 @@ class AFOLIE图像倍数缩放:
             图像: 输入图像张量
             倍数: 缩放倍数
             采样方法: 重新采样算法
+            缩放引擎: torch / 矩阵 批量缩放，或 PIL 逐帧缩放
+            分块内存上限MB: 大于 0 时分块缩放，限制中间结果内存
+            并行线程数: PIL 引擎同时缩放的帧数
+            快速缩小: 大比例缩小时先做盒式预缩小
         """
         batch_size, orig_height, orig_width, channels = 图像.shape
         
@@ -164,40 +749,99 @@ class AFOLIE图像倍数缩放:
         target_width = max(1, target_width)
         target_height = max(1, target_height)
         
-        # 处理批次中的每个图像
-        resized_images = []
+        result = resize_images(
+            图像, target_width, target_height, 采样方法,
+            缩放引擎, 分块内存上限MB, 并行线程数, 快速缩小
+        )
         
-        for i in range(batch_size):
-            img = 图像[i]
-            
-            # 转换为PIL进行高质量重采样
-            pil_img = tensor2pil(img)
-            
-            # 将重采样方法映射到PIL滤镜
-            resample_map = {
-                "两次立方(平滑渐变)": Image.BICUBIC,
-                "保留细节(扩大)": Image.LANCZOS,
-                "保留细节2.0": Image.LANCZOS,
-                "两次立方(较平滑)(扩大)": Image.BICUBIC,
-                "两次立方(较锐利)(缩减)": Image.BICUBIC,
-                "邻近(硬边缘)": Image.NEAREST,
-                "两次线性": Image.BILINEAR
-            }
-            
-            pil_filter = resample_map.get(采样方法, Image.BICUBIC)
-            
-            # 使用PIL调整大小
-            resized_pil = pil_img.resize((target_width, target_height), pil_filter)
-            
-            # 转换回张量
-            resized_tensor = pil2tensor(resized_pil)
-            
-            resized_images.append(resized_tensor)
+        return (result,)
+
+
+def grid_index(length, count, block):
+    """
+    网格裁剪单个轴的像素索引 (count, block)
+    
+    第 i 块覆盖 [i * block, min((i + 1) * block, length))；
+    边缘不足标准尺寸的块按最近邻（与 PIL NEAREST 相同的像素中心取样）拉伸到 block
+    """
+    starts = torch.arange(count) * block
+    valid = (length - starts).clamp(min=1, max=block)
+    starts = starts.clamp(max=length - 1)
+    offsets = torch.arange(block)
+    # 最近邻取样：floor((i + 0.5) * valid / block)，用整数运算避免浮点误差
+    scaled = ((2 * offsets[None, :] + 1) * valid[:, None]) // (2 * block)
+    return (starts[:, None] + scaled).clamp_(max=length - 1)
+
+
+# 网格羽化方式（网格拼接节点使用）
+FEATHER_MODES = ["线性", "余弦"]
+
+# 网格裁剪的边缘处理方式：图像不能被整除时，边缘子图块如何补足标准尺寸
+GRID_EDGE_MODES = ["拉伸", "常量填充", "反射填充", "复制填充", "向内平移"]
+
+
+def grid_axis(length, count, overlap=0, edge="拉伸"):
+    """
+    网格裁剪单个轴的布局
+    
+    - 拉伸：第 i 块覆盖 [i * block, (i + 1) * block)，边缘不足的块按最近邻拉伸到标准尺寸；
+      有重叠时与「向内平移」相同
+    - 向内平移：每块向两侧各扩展 overlap 像素，边缘的块整体向内平移，
+      所有块都是原图中完整的、尺寸相同的区域
+    - 常量/反射/复制填充：块的位置固定为 [i * block - overlap, (i + 1) * block + overlap)，
+      超出原图的部分按对应方式填充，不改变原图内容
+    
+    Returns:
+        (index, spans, valid, mask)
+        index: 像素索引 (count, tile_size)
+        spans: 每块对应的原图区间 [(start, size), ...]
+        valid: 该区间在子图块中的位置 [(offset, size), ...]，其余部分为填充
+        mask: 常量填充时原图像素的位置 (count, tile_size)，其他方式为 None
+    """
+    block = (length + count - 1) // count
+    
+    if edge not in ("常量填充", "反射填充", "复制填充"):
+        # 只有一块时没有相邻块，不需要重叠；重叠后的块不能超出原图
+        overlap = min(overlap, (length - block) // 2) if count > 1 else 0
         
-        # 将所有图像堆叠回批次
-        result = torch.cat(resized_images, dim=0)
+        if overlap <= 0 and edge != "向内平移":
+            index = grid_index(length, count, block)
+            spans = [
+                (min(i * block, length - 1), max(1, min(block, length - i * block)))
+                for i in range(count)
+            ]
+            return index, spans, [(0, block)] * count, None
         
-        return (result,)
+        tile = block + 2 * overlap
+        starts = [min(max(i * block - overlap, 0), length - tile) for i in range(count)]
+        index = torch.tensor(starts)[:, None] + torch.arange(tile)[None, :]
+        return index, [(start, tile) for start in starts], [(0, tile)] * count, None
+    
+    tile = block + 2 * overlap
+    starts = torch.arange(count) * block - overlap
+    positions = starts[:, None] + torch.arange(tile)[None, :]
+    mask = (positions >= 0) & (positions < length)
+    
+    if edge == "反射填充":
+        # 以边缘像素为轴镜像（不重复边缘像素），超出一个周期时继续折返
+        period = 2 * (length - 1)
+        if period > 0:
+            index = positions.remainder(period)
+            index = torch.where(index >= length, period - index, index)
+        else:
+            index = torch.zeros_like(positions)
+    else:
+        # 复制填充取最近的边缘像素；常量填充的填充位置之后会被 mask 覆盖
+        index = positions.clamp(0, length - 1)
+    
+    spans = []
+    valid = []
+    for start in starts.tolist():
+        valid_start = min(max(start, 0), length)
+        valid_end = max(min(start + tile, length), valid_start)
+        spans.append((valid_start, valid_end - valid_start))
+        valid.append((valid_start - start if valid_end > valid_start else 0, valid_end - valid_start))
+    return index, spans, valid, (mask if edge == "常量填充" else None)
 
 
 class AFOLIE图像网格裁剪:
@@ -230,14 +874,37 @@ class AFOLIE图像网格裁剪:
                     "tooltip": "垂直方向分割数量，0表示不纵向裁剪"
                 }),
             },
+            "optional": {
+                "重叠像素": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 4096,
+                    "step": 1,
+                    "tooltip": "每个子图块向四周扩展的像素数，配合「图像网格拼接」羽化拼回"
+                }),
+                "边缘处理": (GRID_EDGE_MODES, {
+                    "default": "拉伸",
+                    "tooltip": "图像不能被整除时边缘子图块的处理方式：拉伸（旧版行为）、按常量/反射/复制填充，或把最后一块向内平移"
+                }),
+                "填充值": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.01,
+                    "tooltip": "常量填充使用的像素值（0 为黑色，1 为白色）"
+                }),
+                "网格信息": ("AFOLIE_GRID", {
+                    "tooltip": "连接「像素网格检测」时用 图像尺寸 / 单元尺寸 取整作为横向/纵向数量（覆盖上面的设置）；只使用数量，仍从 0 开始等分，不按单元偏移对齐；未检测到网格时沿用上面的设置"
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE", "IMAGE")
-    RETURN_NAMES = ("裁剪图像", "预览图像")
+    RETURN_TYPES = ("IMAGE", "IMAGE", "AFOLIE_TILES")
+    RETURN_NAMES = ("裁剪图像", "预览图像", "图块信息")
     FUNCTION = "crop_image"
     CATEGORY = "AFOLIE/图像"
 
-    def crop_image(self, 图像, 横向数量, 纵向数量):
+    def crop_image(self, 图像, 横向数量, 纵向数量, 重叠像素=0, 边缘处理="拉伸", 填充值=0.0, 网格信息=None):
         """
         将图像按网格裁剪成多个子图像，同时生成预览图像
         
@@ -245,10 +912,16 @@ class AFOLIE图像网格裁剪:
             图像: 输入图像张量
             横向数量: 水平方向分割的块数（列数），0表示不横向裁剪
             纵向数量: 垂直方向分割的块数（行数），0表示不纵向裁剪
+            重叠像素: 相邻子图块之间每侧的重叠像素数
+            边缘处理: 图像不能被整除时边缘子图块的处理方式
+            填充值: 常量填充使用的像素值
+            网格信息: 像素网格检测的结果，只用第一帧的单元尺寸换算出横向/纵向数量，
+                子图块仍按 grid_axis 从 0 等分，不按单元偏移对齐
         
         Returns:
             裁剪图像: 裁剪后的所有子图像（按从左到右、从上到下的顺序）
             预览图像: 原始图像（用于预览）
+            图块信息: 每个子图块在原图中的区域及其在子图块中的有效范围，供网格拼接节点使用
         """
         batch_size, orig_height, orig_width, channels = 图像.shape
         
@@ -256,63 +929,410 @@ class AFOLIE图像网格裁剪:
         actual_横向数量 = max(1, 横向数量)
         actual_纵向数量 = max(1, 纵向数量)
         
-        # 计算每个子图块的标准尺寸（向上取整，确保覆盖所有像素）
-        block_width = (orig_width + actual_横向数量 - 1) // actual_横向数量
-        block_height = (orig_height + actual_纵向数量 - 1) // actual_纵向数量
+        if 网格信息 and 网格信息[0]["detected"]:
+            # 所有帧使用同一布局，按第一帧检测到的单元尺寸计算块数；
+            # 非整数的单元尺寸无法切出等大的子图块，因此只取数量，不使用偏移
+            grid = 网格信息[0]
+            actual_横向数量 = max(1, round(orig_width / grid["cell_width"]))
+            actual_纵向数量 = max(1, round(orig_height / grid["cell_height"]))
         
-        # 存储所有裁剪后的图像和预览图像
-        all_cropped_images = []
-        preview_images = []
+        # 计算每个轴的子图块布局（块尺寸向上取整，确保覆盖所有像素）
+        index_y, spans_y, valid_y, mask_y = grid_axis(orig_height, actual_纵向数量, 重叠像素, 边缘处理)
+        index_x, spans_x, valid_x, mask_x = grid_axis(orig_width, actual_横向数量, 重叠像素, 边缘处理)
+        block_height = index_y.shape[1]
+        block_width = index_x.shape[1]
+        # 子图块比等分块尺寸多出的部分即两侧的重叠
+        overlap_y = (block_height - (orig_height + actual_纵向数量 - 1) // actual_纵向数量) // 2
+        overlap_x = (block_width - (orig_width + actual_横向数量 - 1) // actual_横向数量) // 2
         
-        # 处理批次中的每个图像
-        for b in range(batch_size):
-            img = 图像[b]
-            
-            # 转换为PIL图像
-            pil_img = tensor2pil(img)
-            
-            # === 生成预览图像（直接使用原图）===
-            preview_tensor = pil2tensor(pil_img)
-            preview_images.append(preview_tensor)
-            
-            # === 裁剪图像 ===
-            # 按网格裁剪：从上到下，从左到右
-            for row in range(actual_纵向数量):
-                for col in range(actual_横向数量):
-                    # 计算裁剪区域的坐标
-                    left = col * block_width
-                    upper = row * block_height
-                    right = min(left + block_width, orig_width)
-                    lower = min(upper + block_height, orig_height)
-                    
-                    # 裁剪图像
-                    cropped_pil = pil_img.crop((left, upper, right, lower))
-                    
-                    # 如果裁剪后的尺寸小于标准尺寸，调整到标准尺寸
-                    # 这确保所有子图像尺寸一致，便于后续批量处理
-                    actual_width = right - left
-                    actual_height = lower - upper
-                    
-                    if actual_width != block_width or actual_height != block_height:
-                        # 创建标准尺寸的画布，将裁剪的图像放在左上角
-                        # 使用最近邻插值调整尺寸，保持像素艺术的锐利边缘
-                        cropped_pil = cropped_pil.resize(
-                            (block_width, block_height), 
-                            Image.NEAREST
-                        )
-                    
-                    # 转换回张量
-                    cropped_tensor = pil2tensor(cropped_pil)
-                    
-                    all_cropped_images.append(cropped_tensor)
+        if (block_width * actual_横向数量 == orig_width
+                and block_height * actual_纵向数量 == orig_height):
+            # 能整除且无重叠：所有子图块都是原图的视图，只在最后整理成批次时复制一次
+            tiles = 图像.view(
+                batch_size, actual_纵向数量, block_height, actual_横向数量, block_width, channels
+            )
+        else:
+            # 用索引一次性取出所有子图块（边缘子图块按边缘处理方式拉伸、填充或平移）
+            index_y = index_y.to(图像.device)
+            index_x = index_x.to(图像.device)
+            # (B, 行, 块高, 列, 块宽, C)
+            tiles = 图像[:, index_y[:, :, None, None], index_x[None, None, :, :]]
+            if mask_y is not None:
+                # 常量填充：原图以外的位置写入填充值
+                mask = (mask_y[:, :, None, None] & mask_x[None, None, :, :]).to(图像.device)
+                tiles.masked_fill_(~mask[None, :, :, :, :, None], 填充值)
+        
+        # 按网格顺序排列：每张图从上到下、从左到右
+        cropped_result = tiles.permute(0, 1, 3, 2, 4, 5).reshape(
+            batch_size * actual_纵向数量 * actual_横向数量, block_height, block_width, channels
+        )
+        
+        tile_info = {
+            "image_width": orig_width,
+            "image_height": orig_height,
+            "batch_size": batch_size,
+            "rows": actual_纵向数量,
+            "cols": actual_横向数量,
+            "tile_width": block_width,
+            "tile_height": block_height,
+            # 实际使用的重叠像素（不填充时受原图尺寸限制，可能小于设置值）
+            "overlap": max(overlap_y, overlap_x),
+            "overlap_x": overlap_x,
+            "overlap_y": overlap_y,
+            "edge_mode": 边缘处理,
+            "spans_x": spans_x,
+            "spans_y": spans_y,
+            "valid_x": valid_x,
+            "valid_y": valid_y,
+            # 每张图的子图块在原图中的区域，以及该区域在子图块中的位置（其余部分为填充），
+            # 顺序与裁剪图像一致
+            "tiles": [
+                {
+                    "row": row, "col": col, "x": x, "y": y, "width": w, "height": h,
+                    "tile_x": tx, "tile_y": ty,
+                }
+                for row, ((y, h), (ty, _)) in enumerate(zip(spans_y, valid_y))
+                for col, ((x, w), (tx, _)) in enumerate(zip(spans_x, valid_x))
+            ],
+        }
+        
+        # 预览图像直接使用原图，无需转换
+        return (cropped_result, 图像, tile_info)
+
+
+def _merge_axis(spans, valid, length, crop_size, tile_size, out_length, mode):
+    """
+    网格拼接单个轴的目标索引和羽化权重
+    
+    羽化宽度取每对相邻子图块实际重叠的区间（边缘向内平移的块与相邻块重叠更多）：
+    重叠区内本块的权重从 0 升到 1，相邻块对称地从 1 降到 0，两者之和始终为 1
+    
+    Args:
+        spans: 每块在原图中的区间 [(start, size), ...]
+        valid: 该区间在裁剪出的子图块中的位置 [(offset, size), ...]，其余部分是填充
+        length: 原图该轴尺寸
+        crop_size: 裁剪时子图块该轴的尺寸
+        tile_size: 处理后子图块该轴的尺寸
+        out_length: 拼接结果该轴的尺寸
+        mode: FEATHER_MODES 中的一项
+    
+    Returns:
+        (index, weights)，形状均为 (块数, tile_size)；填充部分的权重为 0
+    """
+    scale = out_length / length
+    # 处理后子图块每个像素中心对应的裁剪时坐标
+    centers = (torch.arange(tile_size, dtype=torch.float64) + 0.5) * (crop_size / tile_size)
+    # 每块在结果中的区间
+    bounds = []
+    for start, size in spans:
+        out_start = round(start * scale)
+        bounds.append((out_start, max(out_start + 1, round((start + size) * scale))))
+    
+    indices = []
+    weights = []
+    for i, (valid_start, valid_size) in enumerate(valid):
+        out_start, out_end = bounds[i]
+        # 有效区域的像素按中心位置映射回它在结果中的区域（拉伸过的边缘块会被还原）
+        inside = (centers >= valid_start) & (centers < valid_start + valid_size)
+        index = out_start + ((centers - valid_start) * (out_end - out_start) / max(valid_size, 1)).floor().long()
+        index = index.clamp_(min=out_start, max=out_end - 1).clamp_(max=out_length - 1)
+        
+        # 只在与相邻子图块重叠的一侧羽化；原图边界一侧和不重叠的一侧权重为 1
+        position = index.double()
+        weight = torch.ones_like(position)
+        if i > 0 and bounds[i - 1][1] > out_start:
+            ramp = bounds[i - 1][1] - out_start
+            weight = torch.minimum(weight, ((position - out_start + 0.5) / ramp).clamp_(0.0, 1.0))
+        if i + 1 < len(bounds) and out_end > bounds[i + 1][0]:
+            ramp = out_end - bounds[i + 1][0]
+            weight = torch.minimum(weight, ((out_end - 0.5 - position) / ramp).clamp_(0.0, 1.0))
+        if mode == "余弦":
+            weight = 0.5 - 0.5 * torch.cos(weight * math.pi)
+        indices.append(index)
+        weights.append(weight * inside)
+    return torch.stack(indices), torch.stack(weights)
+
+
+class AFOLIE图像网格拼接:
+    """
+    图像网格拼接节点
+    把「图像网格裁剪」输出的子图块（可以经过放大等处理）按图块信息拼回整图，
+    重叠区域按线性或余弦羽化混合
+    """
+    
+    def __init__(self):
+        pass
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "图块": ("IMAGE",),
+                "图块信息": ("AFOLIE_TILES",),
+                "羽化方式": (FEATHER_MODES,),
+            },
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("图像",)
+    FUNCTION = "merge_tiles"
+    CATEGORY = "AFOLIE/图像"
+
+    def merge_tiles(self, 图块, 图块信息, 羽化方式):
+        """
+        将子图块拼回整图
+        
+        子图块可以被统一缩放过（如分块放大），结果尺寸按相同比例缩放；
+        裁剪时填充出来的部分不参与拼接
+        
+        Args:
+            图块: 子图块批次，顺序与网格裁剪的输出一致
+            图块信息: 网格裁剪节点输出的图块信息
+            羽化方式: 重叠区域的混合曲线
+        """
+        info = 图块信息
+        rows, cols = info["rows"], info["cols"]
+        batch_size = info["batch_size"]
+        tile_count, tile_height, tile_width, channels = 图块.shape
+        
+        if tile_count != batch_size * rows * cols:
+            raise ValueError(
+                f"子图块数量 {tile_count} 与图块信息不符（应为 {batch_size} × {rows} × {cols}）"
+            )
+        
+        # 处理后的子图块相对裁剪时的缩放比例
+        scale_y = tile_height / info["tile_height"]
+        scale_x = tile_width / info["tile_width"]
+        out_height = max(1, round(info["image_height"] * scale_y))
+        out_width = max(1, round(info["image_width"] * scale_x))
+        
+        # 旧版图块信息没有有效范围，整块都是原图内容
+        valid_y = info.get("valid_y", [(0, info["tile_height"])] * rows)
+        valid_x = info.get("valid_x", [(0, info["tile_width"])] * cols)
+        
+        # 羽化宽度按相邻子图块实际重叠的区间计算
+        index_y, weight_y = _merge_axis(
+            info["spans_y"], valid_y, info["image_height"], info["tile_height"], tile_height,
+            out_height, 羽化方式
+        )
+        index_x, weight_x = _merge_axis(
+            info["spans_x"], valid_x, info["image_width"], info["tile_width"], tile_width,
+            out_width, 羽化方式
+        )
+        
+        device = 图块.device
+        dtype = 图块.dtype if 图块.is_floating_point() else torch.float32
+        # (行, 块高, 列, 块宽) 的结果像素索引和权重
+        flat_index = (index_y[:, :, None, None] * out_width + index_x[None, None, :, :]).flatten().to(device)
+        weights = (weight_y[:, :, None, None] * weight_x[None, None, :, :]).to(device, dtype)
+        
+        # (B*行*列, 块高, 块宽, C) -> (B, 行, 块高, 列, 块宽, C)，与索引顺序一致
+        tiles = 图块.to(dtype).view(batch_size, rows, cols, tile_height, tile_width, channels)
+        tiles = tiles.permute(0, 1, 3, 2, 4, 5) * weights[None, :, :, :, :, None]
+        
+        # 加权累加所有子图块，再除以权重和
+        canvas = torch.zeros((batch_size, out_height * out_width, channels), dtype=dtype, device=device)
+        canvas.index_add_(1, flat_index, tiles.reshape(batch_size, -1, channels))
+        weight_sum = torch.zeros(out_height * out_width, dtype=dtype, device=device)
+        weight_sum.index_add_(0, flat_index, weights.flatten())
+        canvas /= weight_sum.clamp_(min=1e-8)[None, :, None]
+        
+        return (canvas.view(batch_size, out_height, out_width, channels),)
+
+
+class AFOLIE像素网格检测:
+    """
+    像素网格检测节点
+    用边缘强度的 FFT 频谱检测像素艺术的网格单元尺寸和偏移，
+    结果可同时供像素对齐和网格裁剪使用，不必各自重新检测
+    """
+    
+    def __init__(self):
+        pass
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "图像": ("IMAGE",),
+            },
+            "optional": {
+                "最小单元": ("INT", {
+                    "default": 2,
+                    "min": 2,
+                    "max": 1024,
+                    "step": 1,
+                    "tooltip": "检测的最小单元尺寸（像素）"
+                }),
+                "最大单元": ("INT", {
+                    "default": 64,
+                    "min": 2,
+                    "max": 4096,
+                    "step": 1,
+                    "tooltip": "检测的最大单元尺寸（像素），检测精灵图表格时可调大"
+                }),
+            },
+        }
+    
+    RETURN_TYPES = ("AFOLIE_GRID", "INT", "INT")
+    RETURN_NAMES = ("网格信息", "单元宽度", "单元高度")
+    FUNCTION = "detect"
+    CATEGORY = "AFOLIE/图像"
+    
+    def detect(self, 图像, 最小单元=2, 最大单元=64):
+        """
+        逐帧检测像素网格
         
-        # 将所有裁剪后的图像堆叠成批次
-        cropped_result = torch.cat(all_cropped_images, dim=0)
+        Returns:
+            网格信息: 每帧的单元尺寸和偏移 [{"cell_width", "cell_height", "offset_x", "offset_y", "detected"}, ...]
+            单元宽度/单元高度: 第一帧的单元尺寸（取整）
+        """
+        grids = []
+        for i in range(图像.shape[0]):
+            pixels = (图像[i, :, :, :3].cpu().numpy() * 255).astype(np.uint8)
+            grids.append(detect_grid_params(pixels, 最小单元, max(最小单元, 最大单元)))
         
-        # 将所有预览图像堆叠成批次
-        preview_result = torch.cat(preview_images, dim=0)
+        first = grids[0]
+        if not first["detected"]:
+            print("像素网格检测: 未检测到网格，按每个像素一个单元处理")
+        return (grids, max(1, round(first["cell_width"])), max(1, round(first["cell_height"])))
+
+
+# 像素对齐的处理后端
+SNAPPER_BACKENDS = ["自动", "内置", "外部程序"]
+
+# 像素对齐的调色板模式：逐帧聚类，或整个批次共享一个调色板（动画帧颜色不闪烁）
+PALETTE_MODES = ["逐帧", "批次共享"]
+
+# 像素对齐的输出尺寸：缩放回原图尺寸，或每个网格单元一个像素的原生分辨率
+SNAP_OUTPUT_MODES = ["原始尺寸", "原生分辨率"]
+
+# 像素对齐结果缓存：内存中保留的结果数量和总字节数上限（原生分辨率结果可能与原图一样大）
+SNAP_CACHE_SIZE = 256
+SNAP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class SnapResultCache:
+    """
+    像素对齐结果缓存（按内容寻址）
+    
+    键为帧的 uint8 像素与处理参数的 blake2b 摘要，值为对齐后的原生分辨率图像；
+    内存中按 LRU 保留最近的结果（同时限制条目数和总字节数），
+    可选的磁盘目录按总大小上限淘汰最久未用的文件。
+    多个线程同时处理不同帧，读写都加锁
+    """
+    
+    def __init__(self, max_entries=SNAP_CACHE_SIZE, max_bytes=SNAP_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(pixels, *params):
+        """像素内容 + 尺寸 + 参数的摘要"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((pixels.shape, params)).encode("utf-8"))
+        digest.update(np.ascontiguousarray(pixels).data)
+        return digest.hexdigest()
+    
+    def get(self, key, disk_dir=""):
+        """查找缓存，内存未命中时再查磁盘；返回 None 表示未命中"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
         
-        return (cropped_result, preview_result)
+        if disk_dir:
+            path = os.path.join(disk_dir, key + ".npy")
+            try:
+                value = np.load(path)
+                # 更新访问时间，磁盘淘汰按最久未用的顺序
+                os.utime(path)
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                with self.lock:
+                    self.hits += 1
+                return value
+        
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, value, disk_dir="", disk_limit_mb=0):
+        """写入缓存；指定磁盘目录时同时写入磁盘并按大小上限淘汰"""
+        self._remember(key, value)
+        if not disk_dir:
+            return
+        try:
+            os.makedirs(disk_dir, exist_ok=True)
+            # 先写临时文件再改名，避免并发读到写了一半的文件
+            temp_path = os.path.join(disk_dir, f"{key}.{threading.get_ident()}.tmp")
+            with open(temp_path, "wb") as f:
+                np.save(f, value)
+            os.replace(temp_path, os.path.join(disk_dir, key + ".npy"))
+            if disk_limit_mb > 0:
+                self.trim_disk(disk_dir, disk_limit_mb * 1024 * 1024)
+        except OSError as e:
+            print(f"像素对齐缓存写入失败: {disk_dir}, 错误: {str(e)}")
+    
+    def _remember(self, key, value):
+        if value.nbytes > self.max_bytes:
+            # 单个结果超过上限时不放入内存（磁盘缓存不受影响）
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+            self.entries[key] = value
+            self.total_bytes += value.nbytes
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+    
+    @staticmethod
+    def trim_disk(disk_dir, limit_bytes):
+        """磁盘缓存超过上限时，按访问时间从旧到新删除"""
+        files = []
+        for entry in os.scandir(disk_dir):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= limit_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+    
+    def stats(self):
+        """命中/未命中次数、当前内存条目数和占用字节数（供调试查看，执行时不再打印）"""
+        with self.lock:
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "entries": len(self.entries), "bytes": self.total_bytes,
+            }
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# 所有像素对齐节点共享同一个缓存，重复执行工作流时跨节点实例命中
+SNAP_CACHE = SnapResultCache()
 
 
 class AFOLIE像素对齐:
@@ -322,12 +1342,9 @@ class AFOLIE像素对齐:
     """
     
     def __init__(self):
-        # 获取可执行文件路径（在 bin 目录下）
+        # 获取可执行文件路径（在 bin 目录下）；不存在或无法运行时使用内置引擎
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.exe_path = os.path.join(current_dir, "bin", "spritefusion-pixel-snapper.exe")
-        
-        if not os.path.exists(self.exe_path):
-            raise FileNotFoundError(f"找不到可执行文件: {self.exe_path}")
     
     @classmethod
     def INPUT_TYPES(cls):
@@ -342,10 +1359,50 @@ class AFOLIE像素对齐:
                     "tooltip": "图像将被量化到这个数量的颜色"
                 }),
             },
+            "optional": {
+                "处理后端": (SNAPPER_BACKENDS, {
+                    "default": "自动",
+                    "tooltip": "自动：Windows 上有可执行文件时使用外部程序，否则使用内置引擎；内置：NumPy 实现，无需子进程和临时文件"
+                }),
+                "并行进程数": ("INT", {
+                    "default": 4,
+                    "min": 1,
+                    "max": 32,
+                    "step": 1,
+                    "tooltip": "批量处理时同时处理的帧数（外部程序为同时运行的进程数）"
+                }),
+                "网格信息": ("AFOLIE_GRID", {
+                    "tooltip": "连接「像素网格检测」时直接使用检测到的网格，不再逐帧检测（仅内置引擎）"
+                }),
+                "调色板模式": (PALETTE_MODES, {
+                    "default": "逐帧",
+                    "tooltip": "逐帧：每帧单独量化颜色；批次共享：从整个批次抽样生成一个调色板，动画帧之间颜色保持一致"
+                }),
+                "使用缓存": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同像素内容和参数的帧直接使用缓存结果，跳过处理"
+                }),
+                "磁盘缓存目录": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "留空则只在内存中缓存；填写目录后结果同时保存到磁盘，重启后仍可命中"
+                }),
+                "磁盘缓存上限MB": ("INT", {
+                    "default": 1024,
+                    "min": 0,
+                    "max": 1048576,
+                    "step": 64,
+                    "tooltip": "磁盘缓存的总大小上限，超出时删除最久未用的结果；0 表示不限制"
+                }),
+                "输出尺寸": (SNAP_OUTPUT_MODES, {
+                    "default": "原始尺寸",
+                    "tooltip": "原始尺寸：最近邻放大回原图尺寸；原生分辨率：每个网格单元一个像素，配合输出的缩放倍数在最后再放大"
+                }),
+            },
         }
     
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("对齐后的图像",)
+    RETURN_TYPES = ("IMAGE", "FLOAT")
+    RETURN_NAMES = ("对齐后的图像", "缩放倍数")
     FUNCTION = "process"
     CATEGORY = "AFOLIE/图像"
     DESCRIPTION = """
@@ -363,27 +1420,24 @@ class AFOLIE像素对齐:
     • 需要完美缩放的 2D 游戏资源和 3D 纹理
     """
     
-    def tensor_to_pil(self, tensor):
-        """将单个 ComfyUI 张量转换为 PIL 图像"""
-        # tensor shape: [H, W, C]
-        np_image = tensor.cpu().numpy()
-        np_image = (np_image * 255).astype(np.uint8)
-        pil_image = Image.fromarray(np_image)
-        return pil_image
-    
-    def pil_to_tensor(self, pil_image):
-        """将 PIL 图像转换为 ComfyUI 张量（添加批次维度）"""
-        np_image = np.array(pil_image).astype(np.float32)
-        np_image = np_image / 255.0
-        tensor = torch.from_numpy(np_image).unsqueeze(0)
-        return tensor
+    def resolve_backend(self, backend):
+        """根据选项和运行环境确定实际使用的后端"""
+        exe_available = os.path.exists(self.exe_path) and os.name == "nt"
+        if backend == "外部程序":
+            if not os.path.exists(self.exe_path):
+                raise FileNotFoundError(f"找不到可执行文件: {self.exe_path}")
+            return "外部程序"
+        if backend == "自动" and exe_available:
+            return "外部程序"
+        return "内置"
     
     def process_single_image(self, pil_image, k_colors):
         """处理单张图像"""
-        # 创建临时文件
+        # 外部程序只接受文件路径，图像经系统临时目录中的 PNG 交换；
+        # 输入 PNG 不压缩以省去编码时间
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as input_file:
             input_path = input_file.name
-            pil_image.save(input_path, 'PNG')
+            pil_image.save(input_file, 'PNG', compress_level=0)
         
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as output_file:
             output_path = output_file.name
@@ -401,11 +1455,12 @@ class AFOLIE像素对齐:
             )
             
             if result.returncode != 0:
-                error_msg = result.stderr if result.stderr else "未知错误"
+                error_msg = result.stderr.strip() if result.stderr else "未知错误"
                 raise RuntimeError(f"像素对齐处理失败: {error_msg}")
             
-            # 读取输出图像
+            # 读取输出图像（立即载入，之后才能删除临时文件）
             output_image = Image.open(output_path)
+            output_image.load()
             
             # 确保输出图像是 RGB
             if output_image.mode not in ['RGB', 'RGBA']:
@@ -430,42 +1485,148 @@ class AFOLIE像素对齐:
             except:
                 pass
     
-    def process(self, 图像, 颜色数量):
-        """处理图像（支持批量处理）"""
+    def snap_frame(self, pixels, k_colors, backend, palette=None, grid=None):
+        """对齐一帧 uint8 像素，返回原生分辨率（每个网格单元一个像素）的 uint8 数组"""
+        if backend == "内置":
+            # 直接在内存中处理 RGB 像素，不经过 PNG 编解码
+            return snap_pixels(pixels[..., :3], k_colors, palette=palette, grid=grid)
+        if palette is not None:
+            # 外部程序自行量化：先映射到共享调色板，颜色数不超过 k 时量化不会再改变颜色
+            pixels = palette[map_to_palette(pixels[..., :3], palette)]
+        return np.array(self.process_single_image(Image.fromarray(pixels), k_colors))
+    
+    def process_frame(self, frame, k_colors, backend, cache=None, disk_dir="", disk_limit_mb=0,
+                      palette=None, grid=None, native=False):
+        """处理一帧，返回 (H, W, 3) uint8；native 为 False 时缩放回原始尺寸"""
+        original_height, original_width = frame.shape[0], frame.shape[1]
+        pixels = (frame.cpu().numpy() * 255).astype(np.uint8)
+        
+        if cache is not None:
+            palette_key = None if palette is None else palette.tobytes()
+            grid_key = None if grid is None else sorted(grid.items())
+            key = cache.make_key(pixels, k_colors, backend, palette_key, grid_key)
+            snapped = cache.get(key, disk_dir)
+            if snapped is None:
+                snapped = self.snap_frame(pixels, k_colors, backend, palette, grid)
+                cache.put(key, snapped, disk_dir, disk_limit_mb)
+        else:
+            snapped = self.snap_frame(pixels, k_colors, backend, palette, grid)
+        if native:
+            return snapped
+        output_image = Image.fromarray(snapped)
+        
+        # 如果输出尺寸与原始尺寸不同，调整回原始尺寸
+        if output_image.size != (original_width, original_height):
+            output_image = output_image.resize(
+                (original_width, original_height), 
+                Image.NEAREST
+            )
+        return np.array(output_image)
+    
+    def shared_palette(self, 图像, k_colors):
+        """从整个批次均匀抽样像素，生成共享调色板"""
+        samples = 图像[..., :3].reshape(-1, 3)
+        stride = max(1, -(-samples.shape[0] // PALETTE_SAMPLE_LIMIT))
+        samples = (samples[::stride].cpu().numpy() * 255).astype(np.uint8)
+        return batch_palette(samples, k_colors)
+    
+    def stack_native(self, 图像, frames):
+        """
+        将各帧的原生分辨率结果合成批次
+        
+        批次中的图像尺寸必须一致：以第一个成功的帧为准，尺寸不同的帧按最近邻缩放，
+        失败的帧（None）用原图缩小代替
+        """
+        target = next(frame for frame in frames if frame is not None).shape[:2]
+        resized = 0
+        for i, frame in enumerate(frames):
+            if frame is None:
+                original = Image.fromarray((图像[i, :, :, :3].cpu().numpy() * 255).astype(np.uint8))
+                frames[i] = np.array(original.resize((target[1], target[0]), Image.NEAREST))
+            elif frame.shape[:2] != target:
+                frames[i] = np.array(Image.fromarray(frame).resize((target[1], target[0]), Image.NEAREST))
+                resized += 1
+        if resized:
+            print(f"像素对齐: {resized} 帧检测到的网格与第一帧不同，已缩放到 {target[1]}×{target[0]}")
+        return torch.from_numpy(np.stack(frames)).float().div_(255.0)
+    
+    def process(self, 图像, 颜色数量, 处理后端="自动", 并行进程数=4, 网格信息=None, 调色板模式="逐帧",
+                使用缓存=True, 磁盘缓存目录="", 磁盘缓存上限MB=1024, 输出尺寸="原始尺寸"):
+        """
+        处理图像（支持批量处理）
+        
+        各帧并行处理；单帧失败时输出该帧原图并打印错误，不影响其他帧。
+        启用缓存时，像素内容和参数相同的帧直接使用之前的结果；
+        批次共享调色板时，所有帧映射到同一个调色板，只聚类一次
+        
+        Returns:
+            对齐后的图像: 原始尺寸或原生分辨率的图像
+            缩放倍数: 把输出放大回原图宽度所需的倍数（原始尺寸时为 1.0）
+        """
         try:
-            batch_size = 图像.shape[0]
-            output_tensors = []
+            backend = self.resolve_backend(处理后端)
+            cache = SNAP_CACHE if 使用缓存 else None
+            disk_dir = 磁盘缓存目录.strip()
+            batch_size, height, width = 图像.shape[0], 图像.shape[1], 图像.shape[2]
+            palette = self.shared_palette(图像, 颜色数量) if 调色板模式 == "批次共享" else None
+            grids = 网格信息 or None
+            if grids and backend != "内置":
+                print("像素对齐: 外部程序自行检测网格，已忽略网格信息")
+                grids = None
             
-            for i in range(batch_size):
-                single_image = 图像[i]
-                original_height = single_image.shape[0]
-                original_width = single_image.shape[1]
-                
-                pil_image = self.tensor_to_pil(single_image)
-                output_image = self.process_single_image(pil_image, 颜色数量)
-                
-                # 如果输出尺寸与原始尺寸不同，调整回原始尺寸
-                if output_image.size != (original_width, original_height):
-                    output_image = output_image.resize(
-                        (original_width, original_height), 
-                        Image.NEAREST
+            native = 输出尺寸 == "原生分辨率"
+            
+            # 原始尺寸时预分配输出批次，每帧按索引写入；原生分辨率的尺寸要处理后才知道
+            result = None if native else torch.empty((batch_size, height, width, 3), dtype=torch.float32)
+            native_frames = [None] * batch_size
+            errors = [None] * batch_size
+            
+            def run_frame(i):
+                try:
+                    output = self.process_frame(
+                        图像[i], 颜色数量, backend, cache, disk_dir, 磁盘缓存上限MB,
+                        palette, grids[i % len(grids)] if grids else None, native
                     )
-                
-                output_tensor = self.pil_to_tensor(output_image)
-                output_tensors.append(output_tensor)
+                    if native:
+                        native_frames[i] = output
+                    else:
+                        result[i].copy_(torch.from_numpy(output))
+                        result[i].div_(255.0)
+                except Exception as e:
+                    errors[i] = e
+                    if not native:
+                        result[i].copy_(图像[i, :, :, :3].float())
+            
+            if 并行进程数 > 1 and batch_size > 1:
+                with ThreadPoolExecutor(max_workers=min(并行进程数, batch_size)) as executor:
+                    list(executor.map(run_frame, range(batch_size)))
+            else:
+                for i in range(batch_size):
+                    run_frame(i)
+            
+            failed = [i for i, error in enumerate(errors) if error is not None]
+            if len(failed) == batch_size:
+                raise errors[0]
+            for i in failed:
+                print(f"像素对齐: 第 {i + 1} 帧处理失败，已输出原图: {errors[i]}")
             
-            result = torch.cat(output_tensors, dim=0)
-            return (result,)
+            scale = 1.0
+            if native:
+                result = self.stack_native(图像, native_frames)
+                scale = width / result.shape[2]
+            
+            return (result, scale)
                     
         except Exception as e:
             raise RuntimeError(f"像素对齐节点错误: {str(e)}")
 
-
 # Node registration
 NODE_CLASS_MAPPINGS = {
     "AFOLIE图像像素缩放": AFOLIE图像像素缩放,
     "AFOLIE图像倍数缩放": AFOLIE图像倍数缩放,
     "AFOLIE图像网格裁剪": AFOLIE图像网格裁剪,
+    "AFOLIE图像网格拼接": AFOLIE图像网格拼接,
+    "AFOLIE像素网格检测": AFOLIE像素网格检测,
     "AFOLIE像素对齐": AFOLIE像素对齐
 }
 
@@ -473,5 +1634,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "AFOLIE图像像素缩放": "图像像素缩放 📐",
     "AFOLIE图像倍数缩放": "图像倍数缩放 🔢",
     "AFOLIE图像网格裁剪": "图像网格裁剪 ✂️",
+    "AFOLIE图像网格拼接": "图像网格拼接 🧩",
+    "AFOLIE像素网格检测": "像素网格检测 📏",
     "AFOLIE像素对齐": "像素对齐 🎯"
 }
@@ -0,0 +1,414 @@
+"""
+AFOLIE 像素对齐 - 内置处理引擎
+用 NumPy 实现与 spritefusion-pixel-snapper 相同的流程：
+颜色量化 (k-means) → 根据边缘强度检测像素网格 → 每个网格单元取众数颜色
+"""
+
+import math
+
+import numpy as np
+
+
+# k-means 迭代参数
+KMEANS_MAX_ITER = 20
+KMEANS_TOLERANCE = 0.01
+KMEANS_SEED = 42
+# 不重复的颜色超过该数量时，先按粗直方图合并（每个格子取加权平均色）再聚类
+KMEANS_MAX_POINTS = 32768
+KMEANS_COARSE_BITS = 5
+# 分块计算距离时每块的元素数（颜色数 × 中心数）
+DISTANCE_CHUNK_ELEMENTS = 1 << 22
+
+# 统计单元颜色直方图时每块的元素数（单元数 × 颜色数），按单元行分块
+HISTOGRAM_CHUNK_ELEMENTS = 1 << 20
+
+# 批次共享调色板时，从整个批次中抽样的最大像素数
+PALETTE_SAMPLE_LIMIT = 262144
+
+# 网格检测参数
+MIN_CELL_SIZE = 2          # 最小的单元尺寸，更小的周期视为噪声
+SNAP_WINDOW = 0.35         # 吸附切线时的搜索范围（相对单元尺寸）
+HARMONIC_THRESHOLD = 0.5   # 频谱中不低于最强峰该比例的最低频率峰视为基频
+FFT_OVERSAMPLE = 8         # 补零倍数，提高频率（周期）分辨率
+PERIOD_SIGNIFICANCE = 50   # 基频功率至少为检测范围内功率中位数的该倍数，否则视为没有周期
+MIN_CELL_COUNT = 8         # 每个方向至少包含的单元数，更大的周期是画面结构而不是像素网格
+AXIS_AGREEMENT_RATIO = 1.5 # 两个方向的单元尺寸相差超过该比例时视为误检
+
+
+def pack_rgb(pixels):
+    """将 (..., 3) 的 uint8 像素打包为 int32 颜色值"""
+    pixels = pixels.astype(np.int32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def unpack_rgb(packed):
+    """将 int32 颜色值还原为 (..., 3) 的 uint8 像素"""
+    return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=-1).astype(np.uint8)
+
+
+def nearest_center(points, centers):
+    """
+    每个点最近的中心（float32，按点分块计算，内存与颜色数无关）
+
+    平方距离 |p|² - 2p·c + |c|² 中 |p|² 对同一个点相同，不影响最近中心，省去不算；
+    0-255 的整数颜色在 float32 下计算是精确的
+
+    Returns:
+        每个点最近的中心索引 (N,)
+    """
+    points = points.astype(np.float32, copy=False)
+    centers = centers.astype(np.float32)
+    center_norms = (centers ** 2).sum(axis=1)
+    chunk = max(1, DISTANCE_CHUNK_ELEMENTS // len(centers))
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk):
+        distance = center_norms[None, :] - 2.0 * (points[start:start + chunk] @ centers.T)
+        labels[start:start + chunk] = distance.argmin(axis=1)
+    return labels
+
+
+def coarse_colors(colors, counts, bits=KMEANS_COARSE_BITS):
+    """
+    按每通道高 bits 位把颜色合并到粗直方图的格子中
+
+    Returns:
+        (points, weights)：每个格子的加权平均色 (M, 3) float64 和像素数 (M,)
+    """
+    shift = 8 - bits
+    coarse = colors.astype(np.int32) >> shift
+    key = (coarse[:, 0] << (2 * bits)) | (coarse[:, 1] << bits) | coarse[:, 2]
+    _, inverse = np.unique(key, return_inverse=True)
+    inverse = inverse.ravel()
+    weights = np.bincount(inverse, weights=counts).astype(np.float64)
+    points = np.stack([
+        np.bincount(inverse, weights=counts * colors[:, c].astype(np.float64))
+        for c in range(3)
+    ], axis=1) / weights[:, None]
+    return points, weights
+
+
+def _kmeans_plus_plus(points, weights, k, rng):
+    """按像素数加权的 k-means++ 初始化"""
+    centers = np.empty((k, 3), dtype=np.float64)
+    centers[0] = points[rng.choice(len(points), p=weights / weights.sum())]
+    distance = ((points - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        probability = distance * weights
+        total = probability.sum()
+        if total <= 0:
+            # 剩余颜色都已经是中心，复制已有中心即可
+            centers[i:] = centers[0]
+            break
+        centers[i] = points[rng.choice(len(points), p=probability / total)]
+        distance = np.minimum(distance, ((points - centers[i]) ** 2).sum(axis=1))
+    return centers
+
+
+def kmeans_palette(colors, counts, k_colors, seed=KMEANS_SEED):
+    """
+    对去重后的颜色做加权 k-means
+
+    同一颜色的像素聚类结果相同，只需对不重复的颜色计算，按像素数加权；
+    颜色过多（如带噪点的图像）时先合并到粗直方图中再聚类，最后把所有颜色分到最近的中心
+
+    Args:
+        colors: 不重复的颜色 (N, 3) uint8
+        counts: 每种颜色的像素数 (N,)
+        k_colors: 目标颜色数量
+
+    Returns:
+        (palette, labels)
+        palette: 调色板 (K, 3) uint8，K <= k_colors
+        labels: 每种颜色对应的调色板索引 (N,)
+    """
+    if len(colors) <= k_colors:
+        return colors.astype(np.uint8), np.arange(len(colors))
+
+    if len(colors) > KMEANS_MAX_POINTS:
+        points, weights = coarse_colors(colors, counts)
+    else:
+        points = colors.astype(np.float64)
+        weights = counts.astype(np.float64)
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_plus_plus(points, weights, k_colors, rng)
+
+    for _ in range(KMEANS_MAX_ITER):
+        labels = nearest_center(points, centers)
+
+        totals = np.bincount(labels, weights=weights, minlength=k_colors)
+        new_centers = np.stack([
+            np.bincount(labels, weights=weights * points[:, c], minlength=k_colors)
+            for c in range(3)
+        ], axis=1)
+        # 空簇保留原中心
+        filled = totals > 0
+        new_centers[filled] /= totals[filled, None]
+        new_centers[~filled] = centers[~filled]
+
+        shift = np.abs(new_centers - centers).max()
+        centers = new_centers
+        if shift < KMEANS_TOLERANCE:
+            break
+
+    labels = nearest_center(colors, centers)
+    palette = np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+    return palette, labels
+
+
+def quantize_colors(pixels, k_colors, seed=KMEANS_SEED):
+    """
+    将图像量化到 k_colors 种颜色
+
+    Args:
+        pixels: (H, W, 3) uint8
+
+    Returns:
+        (palette, indices)
+        palette: 调色板 (K, 3) uint8
+        indices: 每个像素的调色板索引 (H, W)
+    """
+    colors, inverse, counts = np.unique(pack_rgb(pixels).ravel(), return_inverse=True, return_counts=True)
+    palette, labels = kmeans_palette(unpack_rgb(colors), counts, k_colors, seed)
+    return palette, labels[inverse.ravel()].reshape(pixels.shape[:2])
+
+
+def batch_palette(samples, k_colors, seed=KMEANS_SEED):
+    """
+    从整个批次抽样的像素中生成共享调色板
+
+    Args:
+        samples: 抽样像素 (N, 3) uint8
+
+    Returns:
+        调色板 (K, 3) uint8
+    """
+    colors, counts = np.unique(pack_rgb(samples), return_counts=True)
+    palette, _ = kmeans_palette(unpack_rgb(colors), counts, k_colors, seed)
+    return palette
+
+
+def map_to_palette(pixels, palette):
+    """
+    将图像映射到给定调色板上最近的颜色
+
+    只对不重复的颜色计算距离，再通过 np.unique 的逆索引展开到每个像素
+
+    Returns:
+        每个像素的调色板索引 (H, W)
+    """
+    colors, inverse = np.unique(pack_rgb(pixels).ravel(), return_inverse=True)
+    return nearest_center(unpack_rgb(colors), palette)[inverse.ravel()].reshape(pixels.shape[:2])
+
+
+def edge_profiles(pixels):
+    """
+    每条列/行边界两侧的颜色变化强度之和
+
+    Returns:
+        (profile_y, profile_x)
+        profile_y[i]: 第 i 行与第 i+1 行之间的边缘强度 (H-1,)
+        profile_x[j]: 第 j 列与第 j+1 列之间的边缘强度 (W-1,)
+    """
+    gray = pixels[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    profile_y = np.abs(np.diff(gray, axis=0)).sum(axis=1)
+    profile_x = np.abs(np.diff(gray, axis=1)).sum(axis=0)
+    return profile_y, profile_x
+
+
+def detect_period(profile, min_cell=MIN_CELL_SIZE, max_cell=None):
+    """
+    用 FFT 检测边缘强度序列的周期（单元尺寸）和相位（偏移）
+
+    边界位置的边缘强度是周期为单元尺寸的脉冲序列，其频谱在基频及其各次谐波处出现峰值；
+    取检测范围内最强峰一定比例以上的最低频率峰作为基频，避免把谐波误认为基频。
+    基频功率必须明显高于检测范围内的功率中位数，噪声和普通照片/截图的频谱没有这样的孤立尖峰。
+    补零提高频率分辨率，允许非整数的单元尺寸
+
+    Args:
+        profile: edge_profiles 输出的某个方向的边缘强度 (L-1,)
+        min_cell, max_cell: 单元尺寸的检测范围（像素），max_cell 不超过 L / MIN_CELL_COUNT
+
+    Returns:
+        (cell, offset)：单元尺寸和第一条边界的位置（0 <= offset < cell），检测不到时返回 None
+    """
+    length = profile.size + 1
+    max_cell = min(max_cell or length, length / MIN_CELL_COUNT)
+    if max_cell < min_cell or profile.max() <= 0:
+        return None
+
+    # strength[p]: 位置 p（第 p-1 与第 p 个像素之间）的边缘强度
+    strength = np.zeros(length + 1, dtype=np.float64)
+    strength[1:length] = profile
+    strength -= strength.mean()
+
+    n_fft = 1 << int(math.ceil(math.log2((length + 1) * FFT_OVERSAMPLE)))
+    power = np.abs(np.fft.rfft(strength, n_fft)) ** 2
+    low = max(1, int(math.floor(n_fft / max_cell)))
+    high = min(len(power) - 2, int(math.ceil(n_fft / min_cell)))
+    if high - low < 2:
+        return None
+
+    band = power[low:high + 1]
+    is_peak = np.zeros(band.shape, dtype=bool)
+    is_peak[1:-1] = (band[1:-1] >= band[:-2]) & (band[1:-1] > band[2:])
+    is_peak &= band >= HARMONIC_THRESHOLD * band.max()
+    peaks = np.flatnonzero(is_peak)
+    if peaks.size == 0:
+        return None
+    k = low + int(peaks[0])
+    if power[k] < PERIOD_SIGNIFICANCE * np.median(band):
+        return None
+
+    # 抛物线插值得到亚频点精度的峰值位置
+    left, center, right = power[k - 1], power[k], power[k + 1]
+    denominator = left - 2 * center + right
+    shift = 0.5 * (left - right) / denominator if denominator != 0 else 0.0
+    frequency = (k + shift) / n_fft
+    cell = 1.0 / frequency
+    if not min_cell <= cell <= max_cell:
+        return None
+
+    # 基频处的相位即脉冲序列的位置：sum s(x)·e^{-2πifx} 的辐角为 -2πf·offset
+    positions = np.arange(length + 1)
+    phase = np.angle((strength * np.exp(-2j * np.pi * frequency * positions)).sum())
+    offset = (-phase / (2 * np.pi) * cell) % cell
+    # 与单元尺寸相差不到半个像素的偏移实际是 0
+    if cell - offset < 0.5:
+        offset = 0.0
+    return cell, offset
+
+
+def detect_grid_params(pixels, min_cell=MIN_CELL_SIZE, max_cell=None):
+    """
+    检测图像的像素网格参数
+
+    两个方向都要检测到显著的周期且单元尺寸相近；某个方向完全没有边缘（如纯色条带）时借用另一个方向的单元尺寸
+
+    Returns:
+        {"cell_width", "cell_height", "offset_x", "offset_y", "detected"}；
+        检测不到时单元尺寸为 1（每个像素一个单元）
+    """
+    not_detected = {"cell_width": 1.0, "cell_height": 1.0, "offset_x": 0.0, "offset_y": 0.0, "detected": False}
+    profile_y, profile_x = edge_profiles(pixels)
+    result_y = detect_period(profile_y, min_cell, max_cell)
+    result_x = detect_period(profile_x, min_cell, max_cell)
+
+    if result_y is None and result_x is not None and profile_y.max(initial=0) <= 0:
+        result_y = (result_x[0], 0.0)
+    if result_x is None and result_y is not None and profile_x.max(initial=0) <= 0:
+        result_x = (result_y[0], 0.0)
+    if result_x is None or result_y is None:
+        return not_detected
+    if max(result_x[0], result_y[0]) > AXIS_AGREEMENT_RATIO * min(result_x[0], result_y[0]):
+        return not_detected
+    return {
+        "cell_width": float(result_x[0]),
+        "cell_height": float(result_y[0]),
+        "offset_x": float(result_x[1]),
+        "offset_y": float(result_y[1]),
+        "detected": True,
+    }
+
+
+def lattice_cuts(profile, length, cell, offset):
+    """
+    按给定的单元尺寸和偏移生成切线，并把每条切线吸附到附近最强的边缘上
+
+    首尾不足半个单元的部分并入相邻单元
+
+    Returns:
+        切线位置 (n+1,)，首尾分别为 0 和 length
+    """
+    if cell <= 1 or cell >= length:
+        return np.arange(length + 1) if cell <= 1 else np.array([0, length])
+    strength = np.zeros(length + 1, dtype=np.float64)
+    strength[1:length] = profile
+    window = max(1, int(round(cell * SNAP_WINDOW)))
+
+    targets = np.rint(np.arange(offset % cell, length, cell)).astype(np.int64)
+    targets = targets[(targets > 0) & (targets < length)]
+    cuts = []
+    for target in targets:
+        low = max(1, target - window)
+        high = min(length - 1, target + window)
+        candidates = strength[low:high + 1]
+        cuts.append(low + int(candidates.argmax()) if candidates.max() > 0 else int(target))
+    cuts = np.unique(np.array([0] + cuts + [length]))
+
+    if len(cuts) > 2 and cuts[1] < cell * 0.5:
+        cuts = np.delete(cuts, 1)
+    if len(cuts) > 2 and length - cuts[-2] < cell * 0.5:
+        cuts = np.delete(cuts, -2)
+    return cuts
+
+
+def detect_grid(pixels, grid=None):
+    """
+    检测像素网格并生成切线
+
+    Args:
+        grid: 已检测的网格参数（detect_grid_params 的结果）；为 None 时对 pixels 检测
+
+    Returns:
+        (cuts_y, cuts_x)，两个方向的切线位置
+    """
+    height, width = pixels.shape[:2]
+    if grid is None:
+        grid = detect_grid_params(pixels)
+    profile_y, profile_x = edge_profiles(pixels)
+    cuts_y = lattice_cuts(profile_y, height, grid["cell_height"], grid["offset_y"])
+    cuts_x = lattice_cuts(profile_x, width, grid["cell_width"], grid["offset_x"])
+    return cuts_y, cuts_x
+
+
+def resample_cells(indices, palette, cuts_y, cuts_x):
+    """
+    每个网格单元取出现次数最多的颜色
+
+    Args:
+        indices: 每个像素的调色板索引 (H, W)
+        palette: 调色板 (K, 3)
+        cuts_y, cuts_x: 切线位置
+
+    Returns:
+        每个单元一个像素的图像 (rows, cols, 3) uint8
+    """
+    rows, cols = len(cuts_y) - 1, len(cuts_x) - 1
+    if (rows, cols) == indices.shape:
+        # 每个像素一个单元（未检测到网格），不需要统计
+        return palette[indices]
+    k = len(palette)
+    # 每个像素所属的单元行/列编号
+    cell_y = np.repeat(np.arange(rows), np.diff(cuts_y))
+    cell_x = np.repeat(np.arange(cols), np.diff(cuts_x))
+    # 按单元行分块，每块一次 bincount 统计块内所有单元的颜色直方图，内存不随单元数 × 颜色数增长
+    chunk_rows = max(1, HISTOGRAM_CHUNK_ELEMENTS // (cols * k))
+    mode = np.empty((rows, cols), dtype=np.int64)
+    for start in range(0, rows, chunk_rows):
+        stop = min(rows, start + chunk_rows)
+        block = indices[cuts_y[start]:cuts_y[stop]]
+        cell = (cell_y[cuts_y[start]:cuts_y[stop], None] - start) * cols + cell_x[None, :]
+        histogram = np.bincount((cell * k + block).ravel(), minlength=(stop - start) * cols * k)
+        mode[start:stop] = histogram.reshape(stop - start, cols, k).argmax(axis=2)
+    return palette[mode]
+
+
+def snap_pixels(pixels, k_colors, seed=KMEANS_SEED, palette=None, grid=None):
+    """
+    像素对齐：量化颜色、检测网格并按单元重采样
+
+    Args:
+        pixels: (H, W, 3) uint8
+        k_colors: 颜色数量
+        palette: 共享调色板 (K, 3) uint8；为 None 时对本帧单独聚类
+        grid: 已检测的网格参数（detect_grid_params 的结果）；为 None 时对量化后的本帧检测
+
+    Returns:
+        每个网格单元一个像素的图像 (rows, cols, 3) uint8
+    """
+    if palette is None:
+        palette, indices = quantize_colors(pixels, k_colors, seed)
+    else:
+        indices = map_to_palette(pixels, palette)
+    cuts_y, cuts_x = detect_grid(palette[indices], grid)
+    return resample_cells(indices, palette, cuts_y, cuts_x)
@@ -32,8 +32,10 @@ app.registerExtension({
                 const hexInput = document.createElement("input");
                 hexInput.type = "text";
                 hexInput.value = colorWidget.value || "#ffffff";
-                hexInput.placeholder = "#ffffff";
-                hexInput.style.width = "80px";
+                hexInput.placeholder = "#ffffff, #00ff00:15";
+                hexInput.title = "一个或多个颜色，用逗号分隔；颜色后加 :容差 可单独指定容差；auto 表示从每帧边框自动估计";
+                hexInput.style.flex = "1";
+                hexInput.style.minWidth = "80px";
                 hexInput.style.height = "28px";
                 hexInput.style.padding = "4px 8px";
                 hexInput.style.border = "1px solid #555";
@@ -46,7 +48,7 @@ app.registerExtension({
                 // 创建颜色选择器色块
                 const colorPicker = document.createElement("input");
                 colorPicker.type = "color";
-                colorPicker.value = colorWidget.value || "#ffffff";
+                colorPicker.value = "#ffffff";
                 colorPicker.style.width = "36px";
                 colorPicker.style.height = "28px";
                 colorPicker.style.padding = "0";
@@ -94,7 +96,7 @@ app.registerExtension({
                 colorPreview.style.height = "20px";
                 colorPreview.style.borderRadius = "3px";
                 colorPreview.style.border = "1px solid #666";
-                colorPreview.style.backgroundColor = colorWidget.value || "#ffffff";
+                colorPreview.style.background = "#ffffff";
                 colorPreview.style.boxShadow = "inset 0 0 0 1px rgba(0,0,0,0.1)";
                 
                 // 验证并格式化十六进制颜色
@@ -120,19 +122,64 @@ app.registerExtension({
                     return null;
                 };
                 
-                // 更新所有颜色显示
-                const updateColor = (hexColor) => {
-                    const validColor = validateHexColor(hexColor);
-                    if (validColor) {
-                        hexInput.value = validColor;
-                        colorPicker.value = validColor;
-                        colorPreview.style.backgroundColor = validColor;
-                        colorWidget.value = validColor;
+                // 自动估计背景色的写法（统一显示为 auto）
+                const isAutoColor = (color) => ["auto", "自动"].includes(color.trim().toLowerCase());
+                
+                // 验证并格式化颜色列表：逗号（或分号、空白）分隔，每个颜色可带 ":容差"
+                const validateColorList = (value) => {
+                    const entries = (value || "").split(/[,;\s]+/).filter(entry => entry);
+                    if (entries.length === 0) {
+                        return null;
+                    }
+                    const result = [];
+                    for (const entry of entries) {
+                        const [color, tolerance, extra] = entry.split(":");
+                        const validColor = isAutoColor(color) ? "auto" : validateHexColor(color);
+                        if (!validColor || extra !== undefined) {
+                            return null;
+                        }
+                        if (tolerance === undefined) {
+                            result.push(validColor);
+                        } else if (/^\d+(\.\d+)?$/.test(tolerance) && parseFloat(tolerance) <= 100) {
+                            result.push(`${validColor}:${tolerance}`);
+                        } else {
+                            return null;
+                        }
+                    }
+                    return result.join(", ");
+                };
+                
+                // 颜色列表中的所有颜色（不含容差）
+                const listColors = (colorList) => colorList.split(", ").map(entry => entry.split(":")[0]);
+                
+                // 更新颜色选择器和预览：选择器显示第一个固定颜色，预览显示所有固定颜色，
+                // 只有 auto 时预览显示棋盘格
+                const updatePreview = (colorList) => {
+                    const colors = listColors(colorList).filter(color => color !== "auto");
+                    if (colors.length === 0) {
+                        colorPreview.style.background = "repeating-conic-gradient(#888 0 25%, #ccc 0 50%) 0 0 / 10px 10px";
+                        return;
+                    }
+                    colorPicker.value = colors[0];
+                    colorPreview.style.background = colors.length > 1
+                        ? `linear-gradient(90deg, ${colors.join(", ")})`
+                        : colors[0];
+                };
+                
+                // 更新所有颜色显示（输入过程中不改写输入框，避免打断逗号等的输入）
+                const updateColor = (value, typing = false) => {
+                    const validList = validateColorList(value);
+                    if (validList) {
+                        if (!typing) {
+                            hexInput.value = validList;
+                        }
+                        updatePreview(validList);
+                        colorWidget.value = validList;
                         hexInput.style.borderColor = "#555";
                         
                         // 触发节点更新
                         if (colorWidget.callback) {
-                            colorWidget.callback(validColor);
+                            colorWidget.callback(validList);
                         }
                         this.setDirtyCanvas(true);
                     } else {
@@ -140,15 +187,28 @@ app.registerExtension({
                     }
                 };
                 
+                // 选择器和吸色器只替换第一个颜色，保留列表中的其他颜色及其容差
+                const replaceFirstColor = (hexColor) => {
+                    const current = validateColorList(colorWidget.value);
+                    if (!current) {
+                        updateColor(hexColor);
+                        return;
+                    }
+                    const entries = current.split(", ");
+                    const tolerance = entries[0].split(":")[1];
+                    entries[0] = tolerance === undefined ? hexColor : `${hexColor}:${tolerance}`;
+                    updateColor(entries.join(", "));
+                };
+                
                 // 十六进制输入框事件
                 hexInput.addEventListener("input", (e) => {
-                    updateColor(e.target.value);
+                    updateColor(e.target.value, true);
                 });
                 
                 hexInput.addEventListener("blur", (e) => {
-                    const validColor = validateHexColor(e.target.value);
-                    if (validColor) {
-                        hexInput.value = validColor;
+                    const validList = validateColorList(e.target.value);
+                    if (validList) {
+                        hexInput.value = validList;
                     } else {
                         // 恢复为上一个有效值
                         hexInput.value = colorWidget.value || "#ffffff";
@@ -158,7 +218,7 @@ app.registerExtension({
                 
                 // 颜色选择器事件
                 colorPicker.addEventListener("input", (e) => {
-                    updateColor(e.target.value);
+                    replaceFirstColor(e.target.value);
                 });
                 
                 // 吸色器按钮事件
@@ -168,7 +228,7 @@ app.registerExtension({
                             eyedropperBtn.style.backgroundColor = "#666";
                             const eyeDropper = new EyeDropper();
                             const { sRGBHex } = await eyeDropper.open();
-                            updateColor(sRGBHex);
+                            replaceFirstColor(sRGBHex);
                         } catch (e) {
                             // 用户取消或发生错误
                             console.log("吸色器已取消或出错:", e);
@@ -183,11 +243,12 @@ app.registerExtension({
                 // 监听原始 widget 值变化
                 const originalCallback = colorWidget.callback;
                 colorWidget.callback = (value) => {
-                    const validColor = validateHexColor(value);
-                    if (validColor) {
-                        hexInput.value = validColor;
-                        colorPicker.value = validColor;
-                        colorPreview.style.backgroundColor = validColor;
+                    const validList = validateColorList(value);
+                    if (validList) {
+                        if (document.activeElement !== hexInput) {
+                            hexInput.value = validList;
+                        }
+                        updatePreview(validList);
                     }
                     if (originalCallback) {
                         originalCallback(value);
@@ -212,6 +273,12 @@ app.registerExtension({
                     colorWidget.inputEl.style.display = "none";
                 }
                 
+                // 按已保存的值初始化选择器和预览
+                const initialList = validateColorList(colorWidget.value);
+                if (initialList) {
+                    updatePreview(initialList);
+                }
+                
                 // 调整节点大小
                 this.setSize([280, this.size[1]]);
                 